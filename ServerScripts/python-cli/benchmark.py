@@ -0,0 +1,389 @@
+import os
+import json
+import time
+import asyncio
+import hashlib
+import argparse
+import platform
+import subprocess
+import collections
+
+# Drives load against the services in services.json and reports latency percentiles, throughput
+# and errors per route. Results are written as JSON, and --compare checks them against an earlier
+# run so a change to the HTTP_SERVER template can be caught before it ships.
+
+EXCLUDED_PATHS = ("/metrics", "/docs", "/docs/oauth2-redirect", "/redoc", "/openapi.json")
+
+
+class LoadStats():
+    def __init__(self):
+        self.latencies = []
+        self.statusCodes = collections.Counter()
+        self.errors = collections.Counter()  # Requests that got no response, by reason
+        self.startedAt = time.perf_counter()
+        self.finishedAt = None
+
+    def record(self, latency, status):
+        self.latencies.append(latency)
+        self.statusCodes[status] += 1
+
+    def summary(self):
+        elapsed = (self.finishedAt or time.perf_counter()) - self.startedAt
+        latencies = sorted(self.latencies)
+        failed = sum(self.errors.values()) + sum(count for status, count in self.statusCodes.items() if not 200 <= status < 400)
+        total = len(latencies) + sum(self.errors.values())
+        return {
+            "Requests": total,
+            "Rps": round(len(latencies) / elapsed, 1) if elapsed > 0 else 0,
+            "P50Ms": percentile(latencies, 50),
+            "P95Ms": percentile(latencies, 95),
+            "P99Ms": percentile(latencies, 99),
+            "MaxMs": round(latencies[-1] * 1000, 3) if latencies else None,
+            "ErrorRate": round(failed / total, 4) if total else 0,
+            "StatusCodes": {str(status): count for status, count in sorted(self.statusCodes.items())},
+            "Errors": dict(self.errors),
+        }
+
+
+def percentile(sortedLatencies, percent):
+    """Nearest-rank percentile in milliseconds."""
+    if not sortedLatencies:
+        return None
+    index = max(0, min(len(sortedLatencies) - 1, -(-len(sortedLatencies) * percent // 100) - 1))
+    return round(sortedLatencies[index] * 1000, 3)
+
+
+def get_project_root():
+    return os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def load_services(project_root):
+    services_json_path = os.path.join(project_root, "services.json")
+    if not os.path.exists(services_json_path):
+        print(f"{services_json_path} not found.")
+        return []
+    with open(services_json_path, "r") as f:
+        return json.load(f)
+
+
+def template_version(project_root):
+    """Identify what was measured: the git commit and a hash of the HTTP_SERVER template."""
+    templatePath = os.path.join(project_root, "ServerScripts", "ServiceTemplates", "python", "HTTP_SERVICE.txt")
+    templateHash = None
+    if os.path.exists(templatePath):
+        with open(templatePath, "rb") as f:
+            templateHash = hashlib.sha256(f.read()).hexdigest()[:16]
+    try:
+        gitCommit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=project_root, capture_output=True, text=True, timeout=5).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        gitCommit = None
+    return {"GitCommit": gitCommit, "TemplateHash": templateHash}
+
+
+def service_address(service):
+    """Return (host, port, unixSocket) to reach a service, preferring TCP like the other services do."""
+    host = service.get("ServiceHttpHost", "127.0.0.1")
+    if host in ("0.0.0.0", ""):
+        host = "127.0.0.1"
+    elif host == "::":
+        host = "::1"
+    unixSocket = service.get("ServiceHttpUnixSocket")
+    if service.get("ServiceHttpTcp", True) is False and unixSocket:
+        return host, None, unixSocket
+    return host, service.get("ServiceHttpPort"), None
+
+
+async def open_connection(address):
+    host, port, unixSocket = address
+    if port is None:
+        return await asyncio.open_unix_connection(unixSocket)
+    return await asyncio.open_connection(host, port)
+
+
+def build_request(address, method, path, body=None):
+    host, port, _ = address
+    headers = [f"{method} {path} HTTP/1.1", f"Host: {host}:{port}" if port else "Host: localhost"]
+    payload = b""
+    if body is not None:
+        payload = json.dumps(body).encode()
+        headers += ["Content-Type: application/json", f"Content-Length: {len(payload)}"]
+    return ("\r\n".join(headers) + "\r\n\r\n").encode() + payload
+
+
+async def read_response(reader):
+    """Read one response off a keep-alive connection, return (status, keepAlive)."""
+    head = await reader.readuntil(b"\r\n\r\n")
+    lines = head.split(b"\r\n")
+    status = int(lines[0].split()[1])
+    headers = {}
+    for line in lines[1:]:
+        if b":" in line:
+            name, value = line.split(b":", 1)
+            headers[name.strip().lower()] = value.strip().lower()
+
+    if b"content-length" in headers:
+        await reader.readexactly(int(headers[b"content-length"]))
+    elif headers.get(b"transfer-encoding") == b"chunked":
+        while True:
+            size = int((await reader.readline()).split(b";")[0], 16)
+            await reader.readexactly(size + 2)
+            if size == 0:
+                break
+    elif status not in (204, 304) and not 100 <= status < 200:
+        # No length, the body runs until the server closes
+        await reader.read()
+        return status, False
+    return status, headers.get(b"connection") != b"close"
+
+
+class Connection():
+    def __init__(self, address):
+        self.address = address
+        self.reader = None
+        self.writer = None
+
+    async def request(self, request, timeout):
+        """Send one request, reconnecting if needed, and return its status code."""
+        try:
+            if self.writer is None:
+                self.reader, self.writer = await asyncio.wait_for(open_connection(self.address), timeout)
+            self.writer.write(request)
+            status, keepAlive = await asyncio.wait_for(read_response(self.reader), timeout)
+        except BaseException:
+            self.close()
+            raise
+        if not keepAlive:
+            self.close()
+        return status
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+        self.reader = self.writer = None
+
+
+async def send_and_record(connection, request, timeout, stats, startedAt):
+    try:
+        status = await connection.request(request, timeout)
+    except asyncio.TimeoutError:
+        stats.errors["timeout"] += 1
+        return
+    except (OSError, asyncio.IncompleteReadError, ValueError, IndexError) as e:
+        stats.errors[type(e).__name__] += 1
+        return
+    stats.record(time.perf_counter() - startedAt, status)
+
+
+async def run_closed_loop(address, request, connections, duration, timeout):
+    """Every connection sends its next request as soon as the previous one was answered."""
+    stats = LoadStats()
+    deadline = time.perf_counter() + duration
+
+    async def worker():
+        connection = Connection(address)
+        while time.perf_counter() < deadline:
+            await send_and_record(connection, request, timeout, stats, time.perf_counter())
+        connection.close()
+
+    await asyncio.gather(*[worker() for _ in range(connections)])
+    stats.finishedAt = time.perf_counter()
+    return stats
+
+
+async def run_open_loop(address, request, rate, connections, duration, timeout):
+    """Send rate requests per second on schedule, whether or not earlier ones were answered.
+
+    Latency is measured from the scheduled send time, so time spent waiting for a free
+    connection counts too and a stalled server cannot hide behind a slower request rate.
+    """
+    stats = LoadStats()
+    idleConnections = [Connection(address) for _ in range(connections)]
+    freeConnection = asyncio.Semaphore(connections)
+    tasks = set()
+
+    async def send(scheduledAt):
+        async with freeConnection:
+            connection = idleConnections.pop()
+            try:
+                await send_and_record(connection, request, timeout, stats, scheduledAt)
+            finally:
+                idleConnections.append(connection)
+
+    startedAt = time.perf_counter()
+    sent = 0
+    while True:
+        now = time.perf_counter()
+        if now - startedAt >= duration:
+            break
+        # Catch up on everything that became due while sleeping
+        while startedAt + sent / rate <= now:
+            task = asyncio.create_task(send(startedAt + sent / rate))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+            sent += 1
+        await asyncio.sleep(max(0, startedAt + sent / rate - time.perf_counter()))
+
+    stats.finishedAt = time.perf_counter()
+    if tasks:
+        # Responses still outstanding at the end count, but not towards the elapsed time
+        await asyncio.wait(tasks, timeout=timeout)
+    for task in list(tasks):
+        if not task.done():
+            task.cancel()
+            stats.errors["unfinished"] += 1
+    for connection in idleConnections:
+        connection.close()
+    return stats
+
+
+async def fetch_json(address, path, timeout):
+    connection = Connection(address)
+    try:
+        connection.reader, connection.writer = await asyncio.wait_for(open_connection(address), timeout)
+        connection.writer.write(build_request(address, "GET", path).replace(b"\r\n\r\n", b"\r\nConnection: close\r\n\r\n"))
+        data = await asyncio.wait_for(connection.reader.read(), timeout)
+    finally:
+        connection.close()
+    head, _, body = data.partition(b"\r\n\r\n")
+    if int(head.split(b"\r\n")[0].split()[1]) != 200:
+        return None
+    if b"transfer-encoding: chunked" in head.lower():
+        chunks, rest = [], body
+        while True:
+            sizeLine, _, rest = rest.partition(b"\r\n")
+            size = int(sizeLine.split(b";")[0], 16)
+            if size == 0:
+                break
+            chunks.append(rest[:size])
+            rest = rest[size + 2:]
+        body = b"".join(chunks)
+    return json.loads(body)
+
+
+async def discover_routes(service, address, timeout):
+    """Routes from ServiceBenchmarkRoutes, else every GET route without required parameters in the OpenAPI schema."""
+    if service.get("ServiceBenchmarkRoutes"):
+        return [{"Method": route.get("Method", "GET").upper(), "Path": route["Path"], "Body": route.get("Body")} for route in service["ServiceBenchmarkRoutes"]]
+
+    schema = await fetch_json(address, "/openapi.json", timeout)
+    if schema is None:
+        return []
+    routes = []
+    for path, operations in schema.get("paths", {}).items():
+        operation = operations.get("get")
+        if operation is None or path in EXCLUDED_PATHS or "{" in path:
+            continue
+        if any(parameter.get("required") for parameter in operation.get("parameters", [])):
+            continue
+        routes.append({"Method": "GET", "Path": path, "Body": None})
+    return routes
+
+
+def print_result(result):
+    route = f"{result['Method']} {result['Path']}"
+    latencies = " ".join(f"{result[key]:>9.2f}" if result[key] is not None else f"{'-':>9}" for key in ("P50Ms", "P95Ms", "P99Ms"))
+    print(f"{result['Service']:<20} {route:<32} {result['Mode']:<12} {result['Rps']:>9.0f} {latencies} {result['ErrorRate']:>7.2%}")
+
+
+def compare_results(previous, results, maxRegression):
+    """Print the change against an earlier run, return the results that regressed by more than maxRegression percent."""
+    # Only runs with the same load settings are comparable
+    resultKey = lambda result: (result["Service"], result["Method"], result["Path"], result["Mode"], result["Connections"], result.get("Rate"))
+    previousResults = {resultKey(result): result for result in previous.get("Results", [])}
+    print(f"\nCompared with {previous.get('Version', {}).get('GitCommit')} (template {previous.get('Version', {}).get('TemplateHash')}):")
+    regressions = []
+    for result in results:
+        before = previousResults.get(resultKey(result))
+        if before is None:
+            continue
+        rpsChange = (result["Rps"] - before["Rps"]) / before["Rps"] * 100 if before["Rps"] else 0
+        p99Change = (result["P99Ms"] - before["P99Ms"]) / before["P99Ms"] * 100 if before["P99Ms"] and result["P99Ms"] is not None else 0
+        errorChange = result["ErrorRate"] - before["ErrorRate"]
+        # Open loop runs at a fixed rate, so only their latency and errors say anything
+        regressed = p99Change > maxRegression or errorChange > 0.01 or (result["Mode"] == "closed" and -rpsChange > maxRegression)
+        if regressed:
+            regressions.append(result)
+        print(f"{result['Service']:<20} {result['Method'] + ' ' + result['Path']:<32} {result['Mode']:<12} REQ/S {rpsChange:+7.1f}%  P99 {p99Change:+7.1f}%  ERRORS {errorChange:+.2%}{'  REGRESSED' if regressed else ''}")
+    return regressions
+
+
+async def benchmark_services(args):
+    project_root = get_project_root()
+    services = [service for service in load_services(project_root) if not args.services or service.get("ServiceName") in args.services]
+    modes = ["closed", "open"] if args.mode == "both" else [args.mode]
+    results = []
+
+    print(f"{'SERVICE':<20} {'ROUTE':<32} {'MODE':<12} {'REQ/S':>9} {'P50 (ms)':>9} {'P95 (ms)':>9} {'P99 (ms)':>9} {'ERRORS':>7}")
+    for service in services:
+        name = service.get("ServiceName")
+        address = service_address(service)
+        if address[1] is None and address[2] is None:
+            print(f"{name}: no HTTP listener configured, skipped")
+            continue
+        try:
+            routes = [{"Method": "GET", "Path": path, "Body": None} for path in args.paths] if args.paths else await discover_routes(service, address, args.timeout)
+        except (OSError, asyncio.TimeoutError, ValueError, IndexError) as e:
+            print(f"{name}: not reachable ({e}), skipped")
+            continue
+        if not routes:
+            print(f"{name}: no routes to benchmark, set ServiceBenchmarkRoutes in services.json")
+            continue
+
+        for route in routes:
+            request = build_request(address, route["Method"], route["Path"], route["Body"])
+            for mode in modes:
+                if mode == "closed":
+                    run = lambda duration: run_closed_loop(address, request, args.connections, duration, args.timeout)
+                    loadSettings = {"Connections": args.connections}
+                else:
+                    run = lambda duration: run_open_loop(address, request, args.rate, args.connections, duration, args.timeout)
+                    loadSettings = {"Connections": args.connections, "Rate": args.rate}
+                if args.warmup > 0:
+                    await run(args.warmup)
+                stats = await run(args.duration)
+                result = {"Service": name, "Method": route["Method"], "Path": route["Path"], "Mode": mode, **loadSettings, **stats.summary()}
+                results.append(result)
+                print_result(result)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the HTTP services listed in services.json")
+    parser.add_argument("services", nargs="*", help="Service names to benchmark (Default: all)")
+    parser.add_argument("--mode", choices=("closed", "open", "both"), default="closed", help="closed: connections send back to back, open: a fixed request rate")
+    parser.add_argument("--connections", type=int, default=32, help="Concurrent connections (closed loop), max connections (open loop)")
+    parser.add_argument("--rate", type=float, default=1000, help="Requests per second for the open loop")
+    parser.add_argument("--duration", type=float, default=10, help="Seconds measured per route and mode")
+    parser.add_argument("--warmup", type=float, default=2, help="Seconds of unmeasured load before each measurement")
+    parser.add_argument("--timeout", type=float, default=5, help="Seconds before a request counts as failed")
+    parser.add_argument("--path", dest="paths", action="append", help="GET path to benchmark instead of the discovered routes (repeatable)")
+    parser.add_argument("--output", default=os.path.join(get_project_root(), "benchmark-results.json"), help="Where to write the JSON results")
+    parser.add_argument("--compare", help="Earlier results file to compare against, exits with 1 on a regression")
+    parser.add_argument("--max-regression", type=float, default=10, help="Percent drop in REQ/S or rise in p99 that counts as a regression")
+    args = parser.parse_args()
+
+    previous = None
+    if args.compare:
+        with open(args.compare, "r") as f:
+            previous = json.load(f)
+
+    startedAt = time.time()
+    results = asyncio.run(benchmark_services(args))
+    report = {
+        "StartedAt": startedAt,
+        "Version": template_version(get_project_root()),
+        "Host": {"Platform": platform.platform(), "Python": platform.python_version(), "Cpus": os.cpu_count()},
+        "Settings": {"Duration": args.duration, "Warmup": args.warmup, "Timeout": args.timeout},
+        "Results": results,
+    }
+    tmp_path = f"{args.output}.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(report, f, indent=4)
+    os.replace(tmp_path, args.output)
+    print(f"\nResults written to {args.output}")
+
+    if previous is not None and compare_results(previous, results, args.max_regression):
+        raise SystemExit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,165 @@
+import os
+import socket
+import subprocess
+
+# Shared by stop-server.py, running-ports.py and restart-server.py: one scan of the
+# kernel socket tables replaces one lsof process per port.
+
+PROC_NET_TABLES = {
+    "tcp": "/proc/net/tcp",
+    "tcp6": "/proc/net/tcp6",
+    "udp": "/proc/net/udp",
+    "udp6": "/proc/net/udp6",
+}
+PROC_NET_UNIX = "/proc/net/unix"
+TCP_LISTEN = "0A"
+UDP_UNCONNECTED = "07"
+UNIX_ACCEPTING = 0x10000  # __SO_ACCEPTCON
+
+
+class SocketIndex():
+    def __init__(self):
+        self.portToPids = {}  # listening port -> set of PIDs
+        self.pidToPorts = {}  # PID -> set of listening ports
+        self.listeningPorts = set()
+        self.unixPathToPids = {}  # listening Unix socket path (as bound) -> set of PIDs
+
+    def add(self, port, pid=None):
+        self.listeningPorts.add(port)
+        if pid is not None:
+            self.portToPids.setdefault(port, set()).add(pid)
+            self.pidToPorts.setdefault(pid, set()).add(port)
+
+    def add_unix(self, path, pid):
+        self.unixPathToPids.setdefault(path, set()).add(pid)
+
+    def pids_for_port(self, port):
+        return sorted(self.portToPids.get(port, ()))
+
+    def pids_for_unix_socket(self, path):
+        # HTTP_SERVER binds "<path>.<pid>" and renames it over path, /proc keeps the bound name
+        pids = set()
+        for boundPath, boundPids in self.unixPathToPids.items():
+            if boundPath == path or (boundPath.startswith(path + ".") and boundPath[len(path) + 1:].isdigit()):
+                pids.update(boundPids)
+        return sorted(pids)
+
+    def services_by_pid(self, services):
+        """Map every PID listening on a service port to the ServiceName owning that port."""
+        portToService = {}
+        for service in services:
+            for key in ("ServiceHttpPort", "ServiceWsPort"):
+                if service.get(key) is not None:
+                    portToService[service[key]] = service.get("ServiceName")
+
+        pidToService = {}
+        for port, serviceName in portToService.items():
+            for pid in self.portToPids.get(port, ()):
+                pidToService[pid] = serviceName
+        return pidToService
+
+
+def read_listening_inodes():
+    """Return {socket inode: port} for every listening TCP and bound UDP socket."""
+    inodes = {}
+    for protocol, path in PROC_NET_TABLES.items():
+        try:
+            with open(path) as f:
+                lines = f.readlines()[1:]
+        except OSError:
+            continue
+
+        listeningState = TCP_LISTEN if protocol.startswith("tcp") else UDP_UNCONNECTED
+        for line in lines:
+            fields = line.split()
+            if len(fields) < 10 or fields[3] != listeningState:
+                continue
+            port = int(fields[1].rsplit(":", 1)[1], 16)
+            inodes[int(fields[9])] = port
+    return inodes
+
+
+def read_listening_unix_inodes():
+    """Return {socket inode: path} for every listening Unix domain socket bound to a file."""
+    inodes = {}
+    try:
+        with open(PROC_NET_UNIX) as f:
+            lines = f.readlines()[1:]
+    except OSError:
+        return inodes
+
+    for line in lines:
+        fields = line.split()
+        if len(fields) < 8 or not int(fields[3], 16) & UNIX_ACCEPTING or fields[7].startswith("@"):
+            continue
+        inodes[int(fields[6])] = fields[7]
+    return inodes
+
+
+def scan_proc(index):
+    inodes = read_listening_inodes()
+    for inode, port in inodes.items():
+        index.add(port)
+    unixInodes = read_listening_unix_inodes()
+
+    for pid in os.listdir("/proc"):
+        if not pid.isdigit():
+            continue
+        fdDir = f"/proc/{pid}/fd"
+        try:
+            fds = os.listdir(fdDir)
+        except OSError:
+            # Process exited or belongs to another user
+            continue
+        for fd in fds:
+            try:
+                target = os.readlink(f"{fdDir}/{fd}")
+            except OSError:
+                continue
+            if target.startswith("socket:["):
+                inode = int(target[8:-1])
+                port = inodes.get(inode)
+                if port is not None:
+                    index.add(port, int(pid))
+                elif inode in unixInodes:
+                    index.add_unix(unixInodes[inode], int(pid))
+
+
+def scan_lsof(index):
+    """Fallback for hosts without /proc (macOS): still a single lsof call for every port."""
+    result = subprocess.run(["lsof", "-nP", "-iTCP", "-sTCP:LISTEN", "-iUDP", "-F", "pn"], capture_output=True, text=True)
+    pid = None
+    for line in result.stdout.splitlines():
+        if line.startswith("p"):
+            pid = int(line[1:])
+        elif line.startswith("n") and "->" not in line:
+            port = line.rsplit(":", 1)[-1]
+            if port.isdigit():
+                index.add(int(port), pid)
+
+
+def remove_stale_unix_socket(path):
+    """Remove a socket file nobody accepts on anymore (left behind by a killed service), return True if removed."""
+    if not path or not os.path.exists(path):
+        return False
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.settimeout(1)
+    try:
+        sock.connect(path)
+        return False
+    except ConnectionRefusedError:
+        os.unlink(path)
+        return True
+    except OSError:
+        return False
+    finally:
+        sock.close()
+
+
+def build_socket_index():
+    index = SocketIndex()
+    if os.path.exists(PROC_NET_TABLES["tcp"]):
+        scan_proc(index)
+    else:
+        scan_lsof(index)
+    return index
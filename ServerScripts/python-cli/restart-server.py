@@ -1,6 +1,12 @@
 import subprocess
 import os
 import shlex
+import time
+import signal
+import argparse
+
+from proc_socket_index import build_socket_index
+from service_registry import load_registry, save_registry, is_pid_alive, compose_file_hash
 
 def stop_docker_compose():
     script_dir = os.path.dirname(os.path.abspath(__file__))
@@ -19,6 +25,9 @@ def run_docker_compose():
     compose_file_yaml = os.path.join(project_root, "docker-compose.yaml")
     if os.path.exists(compose_file_yml) or os.path.exists(compose_file_yaml):
         subprocess.run(["sudo", "docker-compose", "up", "-d"], cwd=project_root)
+        registry = load_registry()
+        registry["ComposeFileHash"] = compose_file_hash(project_root)
+        save_registry(registry)
     else:
         print(f"docker-compose.yml or docker-compose.yaml not found in {project_root}. Skipping docker-compose up.")
 
@@ -32,9 +41,22 @@ def stop_services():
     stop_server = importlib.util.module_from_spec(spec)
     sys.modules["stop_server"] = stop_server
     spec.loader.exec_module(stop_server)
+    return stop_server.discover_ports()
 
-def start_services():
-    # Import and call start_services_from_sh from start-server.py
+def wait_for_ports_released(ports, timeout=10):
+    """Wait until nothing listens on the given ports so the restarted services can bind them."""
+    deadline = time.monotonic() + timeout
+    while True:
+        socketIndex = build_socket_index()
+        busyPorts = [port for port in ports if socketIndex.pids_for_port(port)]
+        if not busyPorts:
+            return True
+        if time.monotonic() >= deadline:
+            print(f"Ports still in use after {timeout}s: {busyPorts}")
+            return False
+        time.sleep(0.1)
+
+def load_start_server():
     import sys
     import importlib.util
     script_dir = os.path.dirname(os.path.abspath(__file__))
@@ -43,9 +65,52 @@ def start_services():
     start_server = importlib.util.module_from_spec(spec)
     sys.modules["start_server"] = start_server
     spec.loader.exec_module(start_server)
+    return start_server
 
-if __name__ == "__main__":
+def start_services():
+    # Import and call start_services_from_services_json from start-server.py
+    start_server = load_start_server()
+    start_server.check_env_file()
+    start_server.start_services_from_services_json()
+
+def restart_docker_compose_if_changed():
+    """Restart docker-compose only if the compose file changed since it was last brought up."""
+    script_dir = os.path.dirname(os.path.abspath(__file__))
+    project_root = os.path.dirname(os.path.dirname(script_dir))
+    currentHash = compose_file_hash(project_root)
+    if currentHash is None:
+        print(f"docker-compose.yml or docker-compose.yaml not found in {project_root}. Skipping docker-compose restart.")
+        return
+    if load_registry().get("ComposeFileHash") == currentHash:
+        print("docker-compose file unchanged. Skipping docker-compose restart.")
+        return
     stop_docker_compose()
-    stop_services()
     run_docker_compose()
-    start_services()
+
+def rolling_restart_services():
+    """Replace every service one at a time, each new instance serves before the old one is drained."""
+    supervisorPid = load_registry().get("SupervisorPid")
+    if is_pid_alive(supervisorPid):
+        # The supervisor owns the processes, so it rolls them itself
+        os.kill(supervisorPid, signal.SIGHUP)
+        print(f"Asked the supervisor (PID {supervisorPid}) to roll the services. The result is printed in its output.")
+        return
+
+    start_server = load_start_server()
+    start_server.check_env_file()
+    start_server.rolling_restart_services_from_services_json()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Restart every service listed in services.json")
+    parser.add_argument("--stop-start", action="store_true", help="Stop everything, then start everything (the whole stack goes down)")
+    args = parser.parse_args()
+
+    if args.stop_start:
+        stop_docker_compose()
+        stoppedPorts = stop_services()
+        wait_for_ports_released(stoppedPorts)
+        run_docker_compose()
+        start_services()
+    else:
+        restart_docker_compose_if_changed()
+        rolling_restart_services()
@@ -1,17 +1,29 @@
-import subprocess
+import os
+import json
 
-def list_working_ports():
+from proc_socket_index import build_socket_index
+
+def load_services():
+    project_root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    services_json_path = os.path.join(project_root, "services.json")
+    if not os.path.exists(services_json_path):
+        return []
+    with open(services_json_path, "r") as f:
+        return json.load(f)
+
+def list_working_ports(socketIndex):
     """List all the ports on which services are currently running."""
-    result = subprocess.run(["lsof", "-i", "-P", "-n"], capture_output=True, text=True)
-    lines = result.stdout.splitlines()
-    ports = set()
-    for line in lines[1:]:
-        parts = line.split()
-        if len(parts) > 8 and ':' in parts[8]:
-            port = parts[8].split(':')[-1]
-            if port.isdigit():
-                ports.add(int(port))
-    return sorted(ports)
+    return sorted(socketIndex.listeningPorts)
+
+def list_running_services(socketIndex, services):
+    """Map each running service from services.json to its PIDs."""
+    running = {}
+    for pid, serviceName in socketIndex.services_by_pid(services).items():
+        running.setdefault(serviceName, []).append(pid)
+    return running
 
-working_ports = list_working_ports()
+socketIndex = build_socket_index()
+working_ports = list_working_ports(socketIndex)
 print("Working Ports: ", working_ports)
+for serviceName, pids in list_running_services(socketIndex, load_services()).items():
+    print(f"{serviceName} : {sorted(pids)}")
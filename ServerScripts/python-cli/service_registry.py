@@ -0,0 +1,121 @@
+import os
+import json
+import hashlib
+import signal
+import subprocess
+import time
+
+# State file written by start-server.py and read by stop-server.py/restart-server.py, so
+# stopping a service is a signal to a recorded PID instead of a port scan.
+
+REGISTRY_FILE_NAME = ".service-registry.json"
+DEFAULT_STOP_GRACE_PERIOD = 10
+
+
+def get_registry_path():
+    project_root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    return os.path.join(project_root, REGISTRY_FILE_NAME)
+
+
+def load_registry():
+    registry_path = get_registry_path()
+    if not os.path.exists(registry_path):
+        return {"SupervisorPid": None, "ComposeFileHash": None, "Services": {}}
+    try:
+        with open(registry_path, "r") as f:
+            return json.load(f)
+    except (OSError, ValueError) as e:
+        print(f"WARNING: could not read {registry_path}: {e}")
+        return {"SupervisorPid": None, "ComposeFileHash": None, "Services": {}}
+
+
+def save_registry(registry):
+    """Write the registry atomically so readers never see a half written file."""
+    registry_path = get_registry_path()
+    tmp_path = f"{registry_path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(registry, f, indent=4)
+    os.replace(tmp_path, registry_path)
+
+
+def compose_file_hash(project_root):
+    """Hash of docker-compose.yml/.yaml, so restarts can skip docker-compose when it did not change."""
+    for fileName in ("docker-compose.yml", "docker-compose.yaml"):
+        compose_path = os.path.join(project_root, fileName)
+        if os.path.exists(compose_path):
+            with open(compose_path, "rb") as f:
+                return hashlib.sha256(f.read()).hexdigest()
+    return None
+
+
+def register_service(registry, service, process, command, restarts=0):
+    registry["Services"][service.get("ServiceName")] = {
+        "Pid": process.pid,
+        "StartedAt": time.time(),
+        "Ports": [service[key] for key in ("ServiceHttpPort", "ServiceWsPort") if service.get(key) is not None],
+        "Command": command,
+        "Restarts": restarts,
+        "StopGracePeriod": service.get("ServiceStopGracePeriod", DEFAULT_STOP_GRACE_PERIOD),
+    }
+
+
+def is_pid_alive(pid, command=None):
+    """True if the PID is running and, when /proc is available, still runs the recorded command (guards against PID reuse)."""
+    if not pid:
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+
+    if os.path.exists(f"/proc/{pid}/stat"):
+        try:
+            with open(f"/proc/{pid}/stat", "r") as f:
+                # Exited but not yet reaped by its parent
+                if f.read().rsplit(")", 1)[-1].split()[0] == "Z":
+                    return False
+        except (OSError, IndexError):
+            return False
+
+    if command and os.path.exists(f"/proc/{pid}/cmdline"):
+        try:
+            with open(f"/proc/{pid}/cmdline", "rb") as f:
+                cmdline = f.read().decode(errors="replace").split("\0")
+        except OSError:
+            return False
+        return command[-1] in cmdline
+    return True
+
+
+def send_signal(pids, sig):
+    remaining = []
+    for pid in pids:
+        try:
+            os.kill(pid, sig)
+        except ProcessLookupError:
+            continue
+        except PermissionError:
+            remaining.append(pid)
+    if remaining:
+        # Processes started by another user (e.g. root), same as the old sudo kill
+        subprocess.run(["sudo", "kill", f"-{int(sig)}"] + [str(pid) for pid in remaining])
+
+
+def terminate_pids(pids, gracePeriod=DEFAULT_STOP_GRACE_PERIOD):
+    """SIGTERM the PIDs so they drain in-flight requests, SIGKILL whatever is still alive after the grace period."""
+    pids = [pid for pid in pids if is_pid_alive(pid)]
+    if not pids:
+        return
+    send_signal(pids, signal.SIGTERM)
+
+    deadline = time.monotonic() + gracePeriod
+    while time.monotonic() < deadline:
+        pids = [pid for pid in pids if is_pid_alive(pid)]
+        if not pids:
+            return
+        time.sleep(0.1)
+
+    print(f"PIDs {pids} did not exit within {gracePeriod}s, sending SIGKILL")
+    send_signal(pids, signal.SIGKILL)
@@ -2,6 +2,21 @@ import subprocess
 import os
 import shlex
 import json
+import asyncio
+import time
+import signal
+import argparse
+import tempfile
+
+from proc_socket_index import build_socket_index, remove_stale_unix_socket
+from service_registry import load_registry, save_registry, register_service, is_pid_alive, terminate_pids, compose_file_hash, DEFAULT_STOP_GRACE_PERIOD
+
+RUNNING_STATUSES = ("READY", "STARTED", "ALREADY RUNNING")
+RESTART_BACKOFF_BASE = 1
+RESTART_BACKOFF_MAX = 60
+STABLE_RUNTIME = 60  # A service that ran this long before crashing starts its backoff from scratch
+# Where HTTP_SERVER puts the probe socket of every instance, <pid>.probe
+INSTANCE_SOCKET_DIR = os.path.join(tempfile.gettempdir(), "microservice-instances")
 
 def run_docker_compose():
     script_dir = os.path.dirname(os.path.abspath(__file__))
@@ -10,6 +25,9 @@ def run_docker_compose():
     compose_file_yaml = os.path.join(project_root, "docker-compose.yaml")
     if os.path.exists(compose_file_yml) or os.path.exists(compose_file_yaml):
         subprocess.run(["sudo", "docker-compose", "up", "-d"], cwd=project_root)
+        registry = load_registry()
+        registry["ComposeFileHash"] = compose_file_hash(project_root)
+        save_registry(registry)
     else:
         print(f"docker-compose.yml or docker-compose.yaml not found in {project_root}. Skipping docker-compose up.")
 
@@ -37,7 +55,380 @@ def load_env_vars(env_path):
                 env_vars[key.strip()] = value.strip()
     return env_vars
 
-def start_services_from_services_json():
+def validate_service_dependencies(services):
+    """Validate ServiceDependsOn entries and return an error message, or None when the graph is usable."""
+    names = {service.get("ServiceName") for service in services}
+    for service in services:
+        for dependency in service.get("ServiceDependsOn", []):
+            if dependency not in names:
+                return f"{service.get('ServiceName')} depends on unknown service {dependency}"
+
+    # Depth first search for cycles
+    dependsOn = {service.get("ServiceName"): service.get("ServiceDependsOn", []) for service in services}
+    state = {}
+
+    def visit(name, path):
+        if state.get(name) == "done":
+            return None
+        if state.get(name) == "visiting":
+            return " -> ".join(path + [name])
+        state[name] = "visiting"
+        for dependency in dependsOn[name]:
+            cycle = visit(dependency, path + [name])
+            if cycle:
+                return cycle
+        state[name] = "done"
+        return None
+
+    for name in dependsOn:
+        cycle = visit(name, [])
+        if cycle:
+            return f"Dependency cycle: {cycle}"
+    return None
+
+def service_tcp_port(service):
+    """The TCP port a service listens on, None for services only listening on a Unix socket."""
+    if service.get("ServiceHttpTcp", True) is False and service.get("ServiceHttpUnixSocket"):
+        return None
+    return service.get("ServiceHttpPort")
+
+def service_ws_port(service):
+    """The extra WebSocket port of a WS_SERVICE, None when it accepts WebSockets on the HTTP port."""
+    return service.get("ServiceWsPort")
+
+def port_in_use(service, socketIndex):
+    """Describe the listener already on the service's ports or Unix socket, None when they are free.
+
+    Called once the registry has no live instance of the service, so the listener belongs to another
+    service or to a copy started by hand, and starting next to it would fail or share its port.
+    """
+    for port in (service_tcp_port(service), service_ws_port(service)):
+        if port is not None and port in socketIndex.listeningPorts:
+            pids = socketIndex.pids_for_port(port)
+            return f"port {port} in use by PID {', '.join(map(str, pids))}" if pids else f"port {port} in use"
+    unixSocket = service.get("ServiceHttpUnixSocket")
+    pids = socketIndex.pids_for_unix_socket(unixSocket) if unixSocket else []
+    if pids:
+        return f"{unixSocket} in use by PID {', '.join(map(str, pids))}"
+    return None
+
+async def probe_service(host, port, healthPath, unixSocket=None):
+    """Return True once the port (or Unix socket) accepts connections (and the health endpoint answers 2xx/3xx if configured)."""
+    if host in ("0.0.0.0", ""):
+        host = "127.0.0.1"
+    elif host == "::":
+        host = "::1"
+    try:
+        if port is None:
+            reader, writer = await asyncio.wait_for(asyncio.open_unix_connection(unixSocket), 1)
+            host, port = "localhost", 80
+        else:
+            reader, writer = await asyncio.wait_for(asyncio.open_connection(host, port), 1)
+    except (OSError, asyncio.TimeoutError):
+        return False
+
+    try:
+        if not healthPath:
+            return True
+        writer.write(f"GET {healthPath} HTTP/1.1\r\nHost: {host}:{port}\r\nConnection: close\r\n\r\n".encode())
+        await writer.drain()
+        statusLine = await asyncio.wait_for(reader.readline(), 1)
+        parts = statusLine.split()
+        return len(parts) > 1 and parts[1].isdigit() and 200 <= int(parts[1]) < 400
+    except (OSError, asyncio.TimeoutError):
+        return False
+    finally:
+        writer.close()
+
+async def wait_for_service_ready(service, process, timeout):
+    host = service.get("ServiceHttpHost", "127.0.0.1")
+    port = service_tcp_port(service)
+    unixSocket = service.get("ServiceHttpUnixSocket")
+    healthPath = service.get("ServiceHealthCheckPath")
+    if port is None and not unixSocket:
+        return "STARTED"
+
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            return f"CRASHED (exit code {process.returncode})"
+        # The WebSocket listener is bound right after the HTTP one, a plain connect is enough
+        if await probe_service(host, port, healthPath, unixSocket) and (service_ws_port(service) is None or await probe_service(host, service_ws_port(service), None)):
+            return "READY"
+        await asyncio.sleep(0.05)
+    return f"TIMEOUT ({timeout}s)"
+
+def launch_service(service, project_root, venv_python, env_vars):
+    folder = service.get("ServiceFolderName")
+    filename = service.get("ServiceFileName")
+    cmd = f"{venv_python} {folder}/{filename}"
+    print(f"Starting: {cmd}")
+    command = shlex.split(cmd)
+    process = subprocess.Popen(
+        command,
+        cwd=project_root,
+        env=env_vars
+    )
+    return process, command
+
+async def start_service(service, project_root, venv_python, env_vars, readyEvents, results, registry, socketIndex):
+    name = service.get("ServiceName")
+    result = {"service": service, "status": None, "process": None, "pid": None, "startup": None, "launchedAt": None}
+    results[name] = result
+
+    try:
+        # Wait for every dependency to become ready before launching
+        for dependency in service.get("ServiceDependsOn", []):
+            await readyEvents[dependency].wait()
+            if results[dependency]["status"] not in RUNNING_STATUSES:
+                result["status"] = f"SKIPPED ({dependency} not ready)"
+                return
+
+        registered = registry["Services"].get(name)
+        if registered and is_pid_alive(registered["Pid"], registered["Command"]):
+            result["status"] = "ALREADY RUNNING"
+            result["pid"] = registered["Pid"]
+            return
+
+        service_path = os.path.join(project_root, service.get("ServiceFolderName"), service.get("ServiceFileName"))
+        if not os.path.exists(service_path):
+            result["status"] = "SKIPPED (file not found)"
+            return
+
+        portInUse = port_in_use(service, socketIndex)
+        if portInUse:
+            result["status"] = f"SKIPPED ({portInUse})"
+            return
+
+        if remove_stale_unix_socket(service.get("ServiceHttpUnixSocket")):
+            print(f"{name}: removed stale socket file {service.get('ServiceHttpUnixSocket')}")
+
+        launchedAt = time.perf_counter()
+        try:
+            result["process"], command = launch_service(service, project_root, venv_python, env_vars)
+        except FileNotFoundError as e:
+            print(f"ERROR: {e}. Check if the venv and service files exist.")
+            result["status"] = "FAILED (venv not found)"
+            return
+        result["pid"] = result["process"].pid
+        result["launchedAt"] = time.monotonic()
+        register_service(registry, service, result["process"], command)
+
+        result["status"] = await wait_for_service_ready(service, result["process"], service.get("ServiceStartupTimeout", 30))
+        result["startup"] = time.perf_counter() - launchedAt
+    finally:
+        readyEvents[name].set()
+
+def print_startup_table(results, totalSeconds):
+    print()
+    print(f"{'SERVICE':<25} {'PORT':>6} {'PID':>8} {'STARTUP (s)':>12}  STATUS")
+    for name, result in results.items():
+        port = service_tcp_port(result["service"]) or ("unix" if result["service"].get("ServiceHttpUnixSocket") else None)
+        pid = result["pid"] if result["pid"] is not None else "-"
+        startup = f"{result['startup']:.3f}" if result["startup"] is not None else "-"
+        print(f"{name:<25} {str(port):>6} {str(pid):>8} {startup:>12}  {result['status']}")
+    print(f"Total: {totalSeconds:.3f}s for {len(results)} services")
+
+async def start_services(services, project_root, venv_python, env_vars, supervise=False):
+    """Launch every service as soon as its dependencies are ready and wait until each one is ready, crashed or timed out."""
+    registry = load_registry()
+    # Scanned before anything is launched, so only listeners started outside this run count
+    socketIndex = build_socket_index()
+    readyEvents = {service.get("ServiceName"): asyncio.Event() for service in services}
+    results = {}
+
+    startedAt = time.perf_counter()
+    await asyncio.gather(*[start_service(service, project_root, venv_python, env_vars, readyEvents, results, registry, socketIndex) for service in services])
+    coldStart = time.perf_counter() - startedAt
+    save_registry(registry)
+
+    # Keep the services.json order in the table
+    results = {service.get("ServiceName"): results[service.get("ServiceName")] for service in services}
+    print_startup_table(results, coldStart)
+
+    if supervise:
+        await supervise_services(results, registry, project_root, venv_python, env_vars)
+    return results
+
+def order_by_dependencies(services):
+    """Return the services so that every service comes after the services it depends on."""
+    byName = {service.get("ServiceName"): service for service in services}
+    ordered = []
+    visited = set()
+
+    def visit(name):
+        if name in visited:
+            return
+        visited.add(name)
+        for dependency in byName[name].get("ServiceDependsOn", []):
+            visit(dependency)
+        ordered.append(byName[name])
+
+    for service in services:
+        visit(service.get("ServiceName"))
+    return ordered
+
+async def wait_for_instance_ready(service, process, timeout):
+    """Wait until this instance itself serves (and answers the health check if configured).
+
+    The old instance accepts on the same listeners until it is stopped, so the instance is
+    probed through its own probe socket rather than the service port.
+    """
+    if service_tcp_port(service) is None and not service.get("ServiceHttpUnixSocket"):
+        return "STARTED"
+    probeSocket = os.path.join(INSTANCE_SOCKET_DIR, f"{process.pid}.probe")
+    healthPath = service.get("ServiceHealthCheckPath")
+
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            return f"CRASHED (exit code {process.returncode})"
+        if await probe_service(None, None, healthPath, probeSocket):
+            return "READY"
+        await asyncio.sleep(0.05)
+    return f"TIMEOUT ({timeout}s)"
+
+async def rolling_restart_service(service, oldPids, project_root, venv_python, env_vars, registry):
+    """Start a new instance that takes the old one's listeners over, wait until it serves, then drain and stop the old one."""
+    loop = asyncio.get_running_loop()
+    gracePeriod = service.get("ServiceStopGracePeriod", DEFAULT_STOP_GRACE_PERIOD)
+    timeout = service.get("ServiceStartupTimeout", 30)
+    result = {"service": service, "status": None, "process": None, "pid": None, "startup": None, "launchedAt": None}
+
+    launchedAt = time.perf_counter()
+    # Only this instance may take the old one's listeners over or bind next to it with SO_REUSEPORT
+    process, command = launch_service(service, project_root, venv_python, dict(env_vars, HTTP_SERVER_ROLLING_START="1"))
+    status = await wait_for_instance_ready(service, process, timeout)
+    result["startup"] = time.perf_counter() - launchedAt
+    if status == "READY":
+        # uvicorn stops accepting on SIGTERM and finishes its in-flight requests, the connections still
+        # queued on the shared listeners are accepted by the new instance
+        await loop.run_in_executor(None, terminate_pids, oldPids, gracePeriod)
+        result["status"] = "ROLLED"
+    else:
+        # The new instance is unhealthy, or could not bind next to an old instance without SO_REUSEPORT
+        print(f"{service.get('ServiceName')}: new instance not ready next to the old one ({status}), restarting with downtime")
+        await loop.run_in_executor(None, terminate_pids, [process.pid], gracePeriod)
+        process.wait()
+        await loop.run_in_executor(None, terminate_pids, oldPids, gracePeriod)
+        launchedAt = time.perf_counter()
+        process, command = launch_service(service, project_root, venv_python, env_vars)
+        result["status"] = await wait_for_service_ready(service, process, timeout)
+        result["startup"] = time.perf_counter() - launchedAt
+        if result["status"] == "READY":
+            result["status"] = "RESTARTED WITH DOWNTIME"
+
+    result["process"] = process
+    result["pid"] = process.pid
+    result["launchedAt"] = time.monotonic()
+    register_service(registry, service, process, command)
+    save_registry(registry)
+    return result
+
+async def rolling_restart_services(services, project_root, venv_python, env_vars):
+    """Roll every service one at a time so the fleet keeps serving during the restart."""
+    registry = load_registry()
+    socketIndex = build_socket_index()
+    results = {}
+    # Dependencies are rolled first, so start_service never has to wait for them
+    readyEvents = {service.get("ServiceName"): asyncio.Event() for service in services}
+    for event in readyEvents.values():
+        event.set()
+
+    startedAt = time.perf_counter()
+    for service in order_by_dependencies(services):
+        name = service.get("ServiceName")
+        registered = registry["Services"].get(name)
+        if registered and is_pid_alive(registered["Pid"], registered["Command"]):
+            oldPids = [registered["Pid"]]
+        else:
+            # Not started through start-server.py, find it by its port
+            oldPids = socketIndex.pids_for_port(service_tcp_port(service))
+            if service.get("ServiceHttpUnixSocket"):
+                oldPids = sorted(set(oldPids) | set(socketIndex.pids_for_unix_socket(service["ServiceHttpUnixSocket"])))
+
+        if oldPids:
+            results[name] = await rolling_restart_service(service, oldPids, project_root, venv_python, env_vars, registry)
+        else:
+            await start_service(service, project_root, venv_python, env_vars, readyEvents, results, registry, socketIndex)
+            save_registry(registry)
+    print_startup_table(results, time.perf_counter() - startedAt)
+    return results
+
+async def supervise_services(results, registry, project_root, venv_python, env_vars):
+    """Restart crashed services with exponential backoff and roll them on SIGHUP, until SIGINT/SIGTERM stops them all gracefully."""
+    registry["SupervisorPid"] = os.getpid()
+    save_registry(registry)
+    print(f"Supervising {sum(1 for result in results.values() if result['process'] is not None)} services (PID {os.getpid()})")
+
+    stopRequested = asyncio.Event()
+    rollRequested = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stopRequested.set)
+    loop.add_signal_handler(signal.SIGHUP, rollRequested.set)
+
+    crashCounts = {}
+    restartAt = {}
+    while not stopRequested.is_set():
+        if rollRequested.is_set():
+            # Sent by restart-server.py
+            rollRequested.clear()
+            rollStartedAt = time.perf_counter()
+            for service in order_by_dependencies([result["service"] for result in results.values()]):
+                result = results[service.get("ServiceName")]
+                if result["process"] is None or result["process"].poll() is not None:
+                    continue
+                oldProcess = result["process"]
+                results[service.get("ServiceName")] = await rolling_restart_service(service, [oldProcess.pid], project_root, venv_python, env_vars, registry)
+                oldProcess.wait()
+            print_startup_table(results, time.perf_counter() - rollStartedAt)
+
+        now = time.monotonic()
+        for name, result in results.items():
+            process = result["process"]
+            if process is None or process.poll() is None:
+                continue
+
+            if name not in restartAt:
+                if now - result["launchedAt"] >= STABLE_RUNTIME:
+                    crashCounts[name] = 0
+                delay = min(RESTART_BACKOFF_BASE * 2 ** crashCounts.get(name, 0), RESTART_BACKOFF_MAX)
+                crashCounts[name] = crashCounts.get(name, 0) + 1
+                restartAt[name] = now + delay
+                print(f"{name} exited with code {process.returncode}, restarting in {delay}s")
+            elif now >= restartAt[name]:
+                del restartAt[name]
+                try:
+                    result["process"], command = launch_service(result["service"], project_root, venv_python, env_vars)
+                except FileNotFoundError as e:
+                    print(f"ERROR: {e}. Could not restart {name}.")
+                    result["process"] = None
+                    continue
+                result["pid"] = result["process"].pid
+                result["launchedAt"] = time.monotonic()
+                register_service(registry, result["service"], result["process"], command, restarts=crashCounts[name])
+                save_registry(registry)
+
+        try:
+            await asyncio.wait_for(stopRequested.wait(), 0.5)
+        except asyncio.TimeoutError:
+            pass
+
+    print("Stopping supervised services")
+    processes = [result["process"] for result in results.values() if result["process"] is not None]
+    gracePeriod = max([result["service"].get("ServiceStopGracePeriod", DEFAULT_STOP_GRACE_PERIOD) for result in results.values()], default=DEFAULT_STOP_GRACE_PERIOD)
+    await loop.run_in_executor(None, terminate_pids, [process.pid for process in processes], gracePeriod)
+    for process in processes:
+        process.wait()
+
+    registry["SupervisorPid"] = None
+    for name, result in results.items():
+        registry["Services"].pop(name, None)
+    save_registry(registry)
+
+def load_services_config():
+    """Return (services, project_root, venv_python, env_vars), or None when services.json is unusable."""
     script_dir = os.path.dirname(os.path.abspath(__file__))
     project_root = os.path.dirname(os.path.dirname(script_dir))
     services_json_path = os.path.join(project_root, "services.json")
@@ -46,7 +437,7 @@ def start_services_from_services_json():
 
     if not os.path.exists(services_json_path):
         print(f"{services_json_path} not found.")
-        return
+        return None
 
     # Load environment variables from .env
     env_vars = os.environ.copy()
@@ -57,29 +448,35 @@ def start_services_from_services_json():
             services = json.load(f)
         except Exception as e:
             print(f"Error reading {services_json_path}: {e}")
-            return
+            return None
 
-    for service in services:
-        folder = service.get("ServiceFolderName")
-        filename = service.get("ServiceFileName")
-        if not folder or not filename:
-            continue
-        service_path = os.path.join(project_root, folder, filename)
-        if not os.path.exists(service_path):
-            print(f"Service file {service_path} not found. Skipping.")
-            continue
-        cmd = f"{venv_python} {folder}/{filename}"
-        print(f"Starting: {cmd}")
-        try:
-            subprocess.Popen(
-                shlex.split(cmd),
-                cwd=project_root,
-                env=env_vars
-            )
-        except FileNotFoundError as e:
-            print(f"ERROR: {e}. Check if the venv and service files exist.")
+    services = [service for service in services if service.get("ServiceFolderName") and service.get("ServiceFileName")]
+    dependencyError = validate_service_dependencies(services)
+    if dependencyError:
+        print(f"ERROR: {dependencyError}. Fix ServiceDependsOn in {services_json_path}.")
+        return None
+
+    return services, project_root, venv_python, env_vars
+
+def start_services_from_services_json(supervise=False):
+    config = load_services_config()
+    if config is None:
+        return {}
+    return asyncio.run(start_services(*config, supervise))
+
+def rolling_restart_services_from_services_json():
+    config = load_services_config()
+    if config is None:
+        return {}
+    return asyncio.run(rolling_restart_services(*config))
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Start every service listed in services.json")
+    parser.add_argument("--supervise", action="store_true", help="Stay in the foreground and restart crashed services with backoff")
+    args = parser.parse_args()
+
     check_env_file()
     run_docker_compose()
-    start_services_from_services_json()
+    results = start_services_from_services_json(args.supervise)
+    if any(result["status"] not in RUNNING_STATUSES for result in results.values()):
+        exit(1)
@@ -2,6 +2,9 @@ import subprocess
 import os
 import json
 
+from proc_socket_index import build_socket_index, remove_stale_unix_socket
+from service_registry import load_registry, save_registry, is_pid_alive, terminate_pids, DEFAULT_STOP_GRACE_PERIOD
+
 def stop_docker_compose():
     script_dir = os.path.dirname(os.path.abspath(__file__))
     project_root = os.path.dirname(os.path.dirname(script_dir))
@@ -9,27 +12,77 @@ def stop_docker_compose():
     compose_file_yaml = os.path.join(project_root, "docker-compose.yaml")
     if os.path.exists(compose_file_yml) or os.path.exists(compose_file_yaml):
         subprocess.run(["sudo", "docker-compose", "down"], cwd=project_root)
+        registry = load_registry()
+        registry["ComposeFileHash"] = None
+        save_registry(registry)
     else:
         print(f"docker-compose.yml or docker-compose.yaml not found in {project_root}. Skipping docker-compose down.")
 
-def find_pid_by_port(port):
-    """Find the PID of the process running on the specified port."""
-    result = subprocess.run(["lsof", "-i", f":{port}"], capture_output=True, text=True)
-    lines = result.stdout.splitlines()
-    if len(lines) > 1:
-        # Extract the PID from the output
-        pid = int(lines[1].split()[1])
-        return pid
-    return None
-
-def stop_service_on_port(port):
-    """Stop the service running on the specified port."""
-    pid = find_pid_by_port(port)
-    if pid:
-        subprocess.run(["sudo", "kill", "-9", str(pid)])
-        print(f"{port} : Service Stopped")
-    else:
-        print(f"{port} : No Service Found")
+def find_pids_by_port(port, socketIndex):
+    """Find the PIDs of the processes running on the specified port (one per worker for multi-worker services)."""
+    return socketIndex.pids_for_port(port)
+
+def stop_services_on_ports(ports):
+    """Stop the services running on the specified ports with a single socket scan."""
+    if not ports:
+        return
+    socketIndex = build_socket_index()
+    pidsToStop = set()
+    for port in ports:
+        pids = find_pids_by_port(port, socketIndex)
+        if pids:
+            pidsToStop.update(pids)
+            print(f"{port} : Service Stopped")
+        else:
+            print(f"{port} : No Service Found")
+
+    terminate_pids(sorted(pidsToStop))
+
+def stop_services_on_unix_sockets(unixSockets):
+    """Stop the services still accepting on the specified Unix sockets, then remove the socket files."""
+    if not unixSockets:
+        return
+    socketIndex = build_socket_index()
+    pidsToStop = set()
+    for path in unixSockets:
+        pids = socketIndex.pids_for_unix_socket(path)
+        if pids:
+            pidsToStop.update(pids)
+            print(f"{path} : Service Stopped")
+
+    terminate_pids(sorted(pidsToStop))
+    for path in unixSockets:
+        if remove_stale_unix_socket(path):
+            print(f"{path} : Socket File Removed")
+
+def stop_registered_services():
+    """Stop the services recorded by start-server.py and return the ports they were serving."""
+    registry = load_registry()
+    stoppedPorts = set()
+    supervisorPid = registry.get("SupervisorPid")
+    if is_pid_alive(supervisorPid):
+        # The supervisor stops its services itself, and must not restart them while they are being stopped
+        gracePeriod = max([entry.get("StopGracePeriod", DEFAULT_STOP_GRACE_PERIOD) for entry in registry["Services"].values()], default=DEFAULT_STOP_GRACE_PERIOD)
+        for serviceName, entry in registry["Services"].items():
+            print(f"{serviceName} : Service Stopped (PID {entry['Pid']}, supervised)")
+            stoppedPorts.update(entry["Ports"])
+        terminate_pids([supervisorPid], gracePeriod + 5)
+        registry = load_registry()
+
+    pidsToStop = []
+    gracePeriod = DEFAULT_STOP_GRACE_PERIOD
+    for serviceName, entry in registry["Services"].items():
+        if is_pid_alive(entry["Pid"], entry["Command"]):
+            pidsToStop.append(entry["Pid"])
+            gracePeriod = max(gracePeriod, entry.get("StopGracePeriod", DEFAULT_STOP_GRACE_PERIOD))
+            print(f"{serviceName} : Service Stopped (PID {entry['Pid']})")
+            stoppedPorts.update(entry["Ports"])
+    terminate_pids(pidsToStop, gracePeriod)
+
+    registry["SupervisorPid"] = None
+    registry["Services"] = {}
+    save_registry(registry)
+    return stoppedPorts
 
 
 
@@ -51,19 +104,31 @@ def discover_ports():
         services_data = json.load(f)
 
     # Example: return a list of ports to stop (replace with your logic)
-    httpPorts = [service["ServiceHttpPort"] for service in services_data if service["ServiceHttpPort"] is not None]
-    wsPorts = [service["ServiceWsPort"] for service in services_data if service["ServiceWsPort"] is not None]
+    httpPorts = [service["ServiceHttpPort"] for service in services_data if service.get("ServiceHttpPort") is not None]
+    wsPorts = [service["ServiceWsPort"] for service in services_data if service.get("ServiceWsPort") is not None]
 
     return httpPorts + wsPorts
 
+def discover_unix_sockets():
+    parent_address = os.path.dirname(os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir)))
+    service_json_file_path = os.path.join(parent_address, "services.json")
+    if not os.path.exists(service_json_file_path):
+        return []
+
+    with open(service_json_file_path, "r") as f:
+        services_data = json.load(f)
+    return [service["ServiceHttpUnixSocket"] for service in services_data if service.get("ServiceHttpUnixSocket")]
+
 def stopServer():
     stop_docker_compose()
     # Mention the Ports you want to stop
     portList = discover_ports()
     print(portList)
 
-    for ports in portList:
-        stop_service_on_port(ports)
+    # Only services that were not started through start-server.py need a port scan
+    registeredPorts = stop_registered_services()
+    stop_services_on_ports([port for port in portList if port not in registeredPorts])
+    stop_services_on_unix_sockets(discover_unix_sockets())
 
 
 stopServer()
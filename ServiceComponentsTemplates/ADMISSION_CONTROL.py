@@ -0,0 +1,178 @@
+import asyncio
+import collections
+import contextlib
+import math
+import random
+
+from PRIVILEGED_IP_FILTER import PRIVILEGED_IP_FILTER
+
+
+class ADMISSION_CONTROL():
+    """Rejects work the service cannot take on in time instead of queueing it without limit.
+
+    Every HTTP request from a non-privileged client passes three checks, cheapest first:
+      1. Adaptive shedding: a monitor task measures the event loop lag, and while it stays
+         above maxLoopLag a growing fraction of new requests is shed, shrinking again once
+         the loop keeps up.
+      2. A token bucket per client IP (ratePerSecond, burst), answered with 429.
+      3. A global limit of maxConcurrent requests in flight. Up to maxQueued more wait at
+         most maxQueueDelay seconds for a slot, the rest are shed right away.
+    Shed requests get a 503 with Retry-After. Clients in privilegedIpAddresses are never limited.
+    """
+
+    MAX_TRACKED_CLIENTS = 100000
+
+    def __init__(self, privilegedIpAddresses, ratePerSecond=50, burst=100, maxConcurrent=100, maxQueued=1000, maxQueueDelay=0.1, maxLoopLag=0.05, lagCheckInterval=0.05, retryAfter=1):
+        self.privilegedIps = PRIVILEGED_IP_FILTER(privilegedIpAddresses)
+        self.ratePerSecond = ratePerSecond  # 0 disables the per-client limit
+        self.burst = max(burst, 1)
+        self.maxConcurrent = maxConcurrent
+        self.maxQueued = maxQueued
+        self.maxQueueDelay = maxQueueDelay
+        self.maxLoopLag = maxLoopLag
+        self.lagCheckInterval = lagCheckInterval
+        self.retryAfter = retryAfter
+
+        self.buckets = {}  # client host -> [tokens, last refill time]
+        self.inFlight = 0
+        self.waiters = collections.deque()  # Futures of the requests waiting for a slot, in arrival order
+        self.loopLag = 0.0
+        self.shedFraction = 0.0
+        self.monitorTask = None
+
+        self.admitted = 0
+        self.rateLimited = 0
+        self.shed = 0
+
+    def install(self, app):
+        app.add_middleware(ADMISSION_CONTROL_MIDDLEWARE, admissionControl=self)
+        app.router.on_startup.append(self.start)
+        app.router.on_shutdown.append(self.close)
+
+    async def start(self):
+        if self.maxLoopLag and self.monitorTask is None:
+            self.monitorTask = asyncio.get_running_loop().create_task(self.monitor_loop_lag())
+
+    async def close(self):
+        if self.monitorTask is not None:
+            self.monitorTask.cancel()
+            await asyncio.gather(self.monitorTask, return_exceptions=True)
+            self.monitorTask = None
+
+    async def monitor_loop_lag(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            start = loop.time()
+            await asyncio.sleep(self.lagCheckInterval)
+            self.loopLag = max(0.0, loop.time() - start - self.lagCheckInterval)
+            # Back off quickly while overloaded, admit more again slowly so the service does not oscillate
+            if self.loopLag > self.maxLoopLag:
+                self.shedFraction = min(0.95, self.shedFraction + 0.1)
+            elif self.shedFraction:
+                self.shedFraction = max(0.0, self.shedFraction - 0.02)
+
+    def take_token(self, host, now):
+        """Return 0 when the client may send the request, else the seconds until it may."""
+        bucket = self.buckets.get(host)
+        if bucket is None:
+            if len(self.buckets) >= self.MAX_TRACKED_CLIENTS:
+                self.forget_idle_clients(now)
+            bucket = self.buckets[host] = [float(self.burst), now]
+        else:
+            bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.ratePerSecond)
+            bucket[1] = now
+
+        if bucket[0] < 1:
+            return (1 - bucket[0]) / self.ratePerSecond
+        bucket[0] -= 1
+        return 0
+
+    def forget_idle_clients(self, now):
+        # A client whose bucket has refilled is indistinguishable from a new one
+        refillTime = self.burst / self.ratePerSecond
+        self.buckets = {host: bucket for host, bucket in self.buckets.items() if now - bucket[1] < refillTime}
+        if len(self.buckets) >= self.MAX_TRACKED_CLIENTS:
+            self.buckets.clear()
+
+    async def acquire_slot(self):
+        """Return True once the request holds a slot, False when it has to be shed."""
+        if self.inFlight < self.maxConcurrent and not self.waiters:
+            self.inFlight += 1
+            return True
+        if len(self.waiters) >= self.maxQueued or not self.maxQueueDelay:
+            return False
+
+        future = asyncio.get_running_loop().create_future()
+        self.waiters.append(future)
+        try:
+            await asyncio.wait_for(future, self.maxQueueDelay)
+            return True
+        except asyncio.TimeoutError:
+            # The slot may have been handed over as the timeout fired, it is ours then
+            return future.done() and not future.cancelled()
+        except asyncio.CancelledError:
+            # The client went away just after a slot was handed over, pass it on
+            if future.done() and not future.cancelled():
+                self.release_slot()
+            raise
+        finally:
+            if future.cancelled():
+                # release_slot may already have popped it while skipping cancelled waiters
+                with contextlib.suppress(ValueError):
+                    self.waiters.remove(future)
+
+    def release_slot(self):
+        # Hand the slot straight to the longest waiting request, in-flight stays the same
+        while self.waiters:
+            future = self.waiters.popleft()
+            if not future.done():
+                future.set_result(None)
+                return
+        self.inFlight -= 1
+
+
+class ADMISSION_CONTROL_MIDDLEWARE():
+    def __init__(self, app, admissionControl):
+        self.app = app
+        self.admissionControl = admissionControl
+
+    async def __call__(self, scope, receive, send):
+        control = self.admissionControl
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        # No peer address means a Unix domain socket, which only local processes can reach
+        client = scope.get("client")
+        host = client[0] if client else "127.0.0.1"
+        if control.privilegedIps.is_privileged_ip(host):
+            await self.app(scope, receive, send)
+            return
+
+        if control.shedFraction and random.random() < control.shedFraction:
+            control.shed += 1
+            await self.reject(send, 503, control.retryAfter)
+            return
+
+        if control.ratePerSecond:
+            wait = control.take_token(host, asyncio.get_running_loop().time())
+            if wait:
+                control.rateLimited += 1
+                await self.reject(send, 429, wait)
+                return
+
+        if not await control.acquire_slot():
+            control.shed += 1
+            await self.reject(send, 503, control.retryAfter)
+            return
+        control.admitted += 1
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            control.release_slot()
+
+    async def reject(self, send, status, retryAfter):
+        detail = b"Too Many Requests" if status == 429 else b"Service Overloaded"
+        headers = [(b"content-type", b"application/json"), (b"retry-after", str(max(1, math.ceil(retryAfter))).encode())]
+        await send({"type": "http.response.start", "status": status, "headers": headers})
+        await send({"type": "http.response.body", "body": b'{"detail":"' + detail + b'"}'})
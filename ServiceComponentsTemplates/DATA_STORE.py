@@ -0,0 +1,153 @@
+import collections
+import json
+import time
+
+
+class DATA_ENTRY():
+    __slots__ = ("value", "expiresAt")
+
+    def __init__(self, value, expiresAt):
+        self.value = value
+        self.expiresAt = expiresAt
+
+
+class MEMORY_DATA_BACKEND():
+    """Per-process store, an LRU bounded by entry count with an optional TTL per key.
+
+    Every operation runs without awaiting anything, so compare_and_set is atomic within the event loop.
+    """
+
+    def __init__(self, maxEntries=100000):
+        self.maxEntries = maxEntries
+        self.entries = collections.OrderedDict()
+
+    def lookup(self, key):
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        if entry.expiresAt is not None and entry.expiresAt <= time.monotonic():
+            del self.entries[key]
+            return None
+        self.entries.move_to_end(key)
+        return entry
+
+    def store(self, key, value, ttl):
+        self.entries[key] = DATA_ENTRY(value, time.monotonic() + ttl if ttl else None)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.maxEntries:
+            self.entries.popitem(last=False)
+
+    async def get(self, key, default=None):
+        entry = self.lookup(key)
+        return default if entry is None else entry.value
+
+    async def set(self, key, value, ttl=None):
+        self.store(key, value, ttl)
+
+    async def delete(self, key):
+        return self.entries.pop(key, None) is not None
+
+    async def compare_and_set(self, key, expected, value, ttl=None):
+        entry = self.lookup(key)
+        current = None if entry is None else entry.value
+        if current != expected:
+            return False
+        self.store(key, value, ttl)
+        return True
+
+    async def close(self):
+        pass
+
+
+class REDIS_DATA_BACKEND():
+    """Store shared by every worker and instance of a service, values are kept as JSON.
+
+    Size-bounded eviction is left to the server (maxmemory with an LRU maxmemory-policy).
+    """
+
+    # Compares the stored JSON with the expected one and swaps in a single round trip
+    COMPARE_AND_SET_SCRIPT = """
+local current = redis.call('GET', KEYS[1])
+if (ARGV[1] == '' and not current) or current == ARGV[1] then
+    if ARGV[3] == '0' then
+        redis.call('SET', KEYS[1], ARGV[2])
+    else
+        redis.call('SET', KEYS[1], ARGV[2], 'PX', ARGV[3])
+    end
+    return 1
+end
+return 0
+"""
+
+    def __init__(self, redisUrl="redis://127.0.0.1:10000", keyPrefix="data-store:"):
+        import redis.asyncio  # Optional dependency, only needed when a shared backend is configured
+        self.client = redis.asyncio.from_url(redisUrl)
+        self.keyPrefix = keyPrefix
+        self.compareAndSet = self.client.register_script(self.COMPARE_AND_SET_SCRIPT)
+
+    def encode(self, value):
+        return json.dumps(value, sort_keys=True, separators=(",", ":"))
+
+    async def get(self, key, default=None):
+        data = await self.client.get(self.keyPrefix + key)
+        return default if data is None else json.loads(data)
+
+    async def set(self, key, value, ttl=None):
+        await self.client.set(self.keyPrefix + key, self.encode(value), px=int(ttl * 1000) if ttl else None)
+
+    async def delete(self, key):
+        return await self.client.delete(self.keyPrefix + key) > 0
+
+    async def compare_and_set(self, key, expected, value, ttl=None):
+        expectedData = "" if expected is None else self.encode(expected)
+        swapped = await self.compareAndSet(keys=[self.keyPrefix + key], args=[expectedData, self.encode(value), int(ttl * 1000) if ttl else 0])
+        return swapped == 1
+
+    async def close(self):
+        await self.client.aclose()
+
+
+class DATA_STORE():
+    """Keyed state for a service, replacing the single-slot Data class.
+
+    Kept in process by default, so every worker of a multi-worker service has its own copy.
+    With redisUrl the workers (and instances) share one copy instead:
+
+        await self.data_class.set("session:42", {"userId": 42}, ttl=300)
+        swapped = await self.data_class.compare_and_set("counter", 1, 2)
+    """
+
+    def __init__(self, maxEntries=100000, defaultTtl=None, redisUrl=None, keyPrefix="data-store:", backend=None):
+        self.defaultTtl = defaultTtl
+        if backend is not None:
+            self.backend = backend
+        elif redisUrl is not None:
+            self.backend = REDIS_DATA_BACKEND(redisUrl, keyPrefix)
+        else:
+            self.backend = MEMORY_DATA_BACKEND(maxEntries)
+
+    async def get(self, key, default=None):
+        return await self.backend.get(key, default)
+
+    async def set(self, key, value, ttl=None):
+        await self.backend.set(key, value, ttl or self.defaultTtl)
+
+    async def delete(self, key):
+        """Return True if the key existed."""
+        return await self.backend.delete(key)
+
+    async def compare_and_set(self, key, expected, value, ttl=None):
+        """Set key to value only if it currently holds expected (None means absent), return True if it was set."""
+        return await self.backend.compare_and_set(key, expected, value, ttl or self.defaultTtl)
+
+    async def update(self, key, function, default=None, ttl=None, retries=10):
+        """Apply function to the current value with compare_and_set, retrying when another writer got there first."""
+        for _ in range(retries):
+            current = await self.get(key)
+            value = function(default if current is None else current)
+            if await self.compare_and_set(key, current, value, ttl):
+                return value
+        raise RuntimeError(f"Could not update {key} after {retries} attempts")
+
+    async def close(self):
+        await self.backend.close()
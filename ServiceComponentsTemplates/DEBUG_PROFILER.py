@@ -0,0 +1,260 @@
+import asyncio
+import collections
+import html
+import io
+import os
+import sys
+import threading
+import time
+import tracemalloc
+import zlib
+
+from fastapi import HTTPException, Request, Response
+
+from PRIVILEGED_IP_FILTER import PRIVILEGED_IP_FILTER
+
+
+class DEBUG_PROFILER():
+    """On-demand profiling of a running service under /debug/profile/, for privileged IP addresses only.
+
+    Nothing runs until an endpoint is called, the only cost otherwise is one more route to match:
+        GET  /debug/profile/cpu?seconds=10&interval=0.005&format=collapsed|flamegraph&threads=loop|all
+             samples the stacks of the event loop thread (or every thread) from a separate thread
+             and returns collapsed stacks (flamegraph.pl, speedscope) or an SVG flamegraph
+        GET  /debug/profile/memory?seconds=10&limit=30&group_by=lineno|filename|traceback
+             traces allocations with tracemalloc for seconds and returns the biggest differences,
+             or the differences since /memory/start while a longer trace is running
+        POST /debug/profile/memory/start?frames=25 and POST /debug/profile/memory/stop
+        GET  /debug/profile/tasks?limit=20
+             the stack of every asyncio task, grouped by coroutine
+    Every worker of a multi-worker service profiles only itself, the X-Worker-Id header tells which one answered.
+    """
+
+    def __init__(self, privilegedIpAddresses, maxDuration=60, minInterval=0.001):
+        self.privilegedIps = PRIVILEGED_IP_FILTER(privilegedIpAddresses)
+        self.maxDuration = maxDuration
+        self.minInterval = minInterval
+        self.workerId = os.environ.get("HTTP_SERVER_WORKER_ID", "0")
+
+        self.cpuLock = asyncio.Lock()
+        self.memoryLock = asyncio.Lock()
+        self.memoryBaseline = None  # Snapshot taken by /memory/start
+        self.memoryStartedTracing = False  # tracemalloc was started here and is stopped here
+
+        self.prefix = None
+        self.actions = {
+            ("GET", ""): self.list_actions,
+            ("GET", "cpu"): self.profile_cpu,
+            ("GET", "memory"): self.profile_memory,
+            ("POST", "memory/start"): self.start_memory_trace,
+            ("POST", "memory/stop"): self.stop_memory_trace,
+            ("GET", "tasks"): self.dump_tasks,
+        }
+
+    def install(self, app, prefix="/debug/profile"):
+        self.prefix = prefix
+        # A single route, so requests to the service's own routes only pay one more pattern match
+        app.add_api_route(prefix + "/{action:path}", self.dispatch, methods=["GET", "POST"], include_in_schema=False)
+
+    async def dispatch(self, request: Request, action: str):
+        # No peer address means a Unix domain socket, which only local processes can reach
+        host = request.client.host if request.client else "127.0.0.1"
+        if not self.privilegedIps.is_privileged_ip(host):
+            raise HTTPException(status_code=403, detail="Forbidden")
+
+        handler = self.actions.get((request.method, action.strip("/")))
+        if handler is None:
+            raise HTTPException(status_code=404, detail=f"Unknown profile action {request.method} {action}, GET {self.prefix}/ lists them")
+        response = await handler(request.query_params)
+        response.headers["X-Worker-Id"] = self.workerId
+        return response
+
+    def text(self, lines):
+        return Response(content="\n".join(lines) + "\n", media_type="text/plain")
+
+    def number(self, params, name, default, minimum, maximum, convert=float):
+        try:
+            value = convert(params.get(name, default))
+        except ValueError:
+            raise HTTPException(status_code=400, detail=f"{name} must be a number")
+        if not minimum <= value <= maximum:
+            raise HTTPException(status_code=400, detail=f"{name} must be between {minimum} and {maximum}")
+        return value
+
+    def choice(self, params, name, choices):
+        value = params.get(name, choices[0])
+        if value not in choices:
+            raise HTTPException(status_code=400, detail=f"{name} must be one of {list(choices)}")
+        return value
+
+    async def list_actions(self, params):
+        return self.text([f"{method:<4} {self.prefix}/{action}" for method, action in self.actions if action])
+
+    async def profile_cpu(self, params):
+        seconds = self.number(params, "seconds", 10, 0.1, self.maxDuration)
+        interval = self.number(params, "interval", 0.005, self.minInterval, 1)
+        outputFormat = self.choice(params, "format", ("collapsed", "flamegraph"))
+        allThreads = self.choice(params, "threads", ("loop", "all")) == "all"
+        if self.cpuLock.locked():
+            raise HTTPException(status_code=409, detail="A CPU profile is already running")
+
+        async with self.cpuLock:
+            loop = asyncio.get_running_loop()
+            done = loop.create_future()
+            # The handler runs on the event loop thread, which is the one worth sampling
+            loopThreadId = threading.get_ident()
+
+            def run_sampler():
+                try:
+                    result = self.sample_stacks(None if allThreads else loopThreadId, seconds, interval)
+                    loop.call_soon_threadsafe(done.set_result, result)
+                except Exception as e:
+                    loop.call_soon_threadsafe(done.set_exception, e)
+
+            threading.Thread(target=run_sampler, name="DEBUG_PROFILER sampler", daemon=True).start()
+            stacks, samples = await done
+
+        if outputFormat == "flamegraph":
+            title = f"CPU {seconds:g}s every {interval * 1000:g}ms, {samples} samples, worker {self.workerId} (pid {os.getpid()})"
+            return Response(content=self.render_flamegraph(stacks, title), media_type="image/svg+xml")
+        return self.text([f"{stack} {count}" for stack, count in sorted(stacks.items(), key=lambda item: -item[1])])
+
+    def sample_stacks(self, threadId, seconds, interval):
+        """Return ({collapsed stack: count}, samples) for one thread (every other thread when threadId is None)."""
+        samplerThreadId = threading.get_ident()
+        threadNames = {thread.ident: thread.name for thread in threading.enumerate()}
+        labels = {}  # code object -> frame label, formatted once per function
+        stacks = collections.Counter()
+        samples = 0
+        deadline = time.monotonic() + seconds
+        while time.monotonic() < deadline:
+            frames = sys._current_frames()
+            for frameThreadId, frame in frames.items():
+                if frameThreadId == samplerThreadId or (threadId is not None and frameThreadId != threadId):
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    label = labels.get(code)
+                    if label is None:
+                        label = labels[code] = f"{code.co_qualname} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})".replace(";", ":")
+                    stack.append(label)
+                    frame = frame.f_back
+                if threadId is None:
+                    stack.append(threadNames.get(frameThreadId, f"thread {frameThreadId}").replace(";", ":"))
+                stacks[";".join(reversed(stack))] += 1
+            samples += 1
+            time.sleep(interval)
+        return stacks, samples
+
+    def render_flamegraph(self, stacks, title, width=1200, rowHeight=16):
+        root = {"count": 0, "children": {}}
+        for stack, count in stacks.items():
+            node = root
+            node["count"] += count
+            for frame in stack.split(";"):
+                node = node["children"].setdefault(frame, {"count": 0, "children": {}})
+                node["count"] += count
+        total = root["count"] or 1
+
+        rects = []  # (x, depth, width, label, count)
+        pending = [("all", root, 0.0, 0)]
+        while pending:
+            label, node, x, depth = pending.pop()
+            nodeWidth = node["count"] / total * width
+            if nodeWidth < 0.3:
+                continue  # Too narrow to see, and so are its children
+            rects.append((x, depth, nodeWidth, label, node["count"]))
+            childX = x
+            for childLabel, child in sorted(node["children"].items()):
+                pending.append((childLabel, child, childX, depth + 1))
+                childX += child["count"] / total * width
+
+        maxDepth = max((rect[1] for rect in rects), default=0)
+        height = (maxDepth + 1) * rowHeight + 40
+        parts = [
+            f'<svg xmlns="http://www.w3.org/2000/svg" width="{width}" height="{height}" font-family="monospace" font-size="11">',
+            f'<rect width="100%" height="100%" fill="#fdfdf6"/><text x="4" y="16" font-size="13">{html.escape(title)}</text>',
+        ]
+        for x, depth, rectWidth, label, count in rects:
+            # Roots at the bottom, callees stacked above their callers
+            y = height - (depth + 1) * rowHeight - 4
+            hue = zlib.crc32(label.encode()) % 55
+            # About 7px per character at font-size 11
+            fittingCharacters = int((rectWidth - 4) / 7)
+            text = label if len(label) <= fittingCharacters else label[:fittingCharacters - 2] + ".." if fittingCharacters > 3 else ""
+            parts.append(
+                f'<g><title>{html.escape(label)} ({count} samples, {count / total * 100:.2f}%)</title>'
+                f'<rect x="{x:.2f}" y="{y}" width="{rectWidth:.2f}" height="{rowHeight - 1}" fill="hsl({hue},85%,60%)"/>'
+                f'<text x="{x + 3:.2f}" y="{y + rowHeight - 4}">{html.escape(text)}</text></g>'
+            )
+        parts.append("</svg>")
+        return "\n".join(parts)
+
+    def memory_statistics(self, baseline, snapshot, params):
+        groupBy = self.choice(params, "group_by", ("lineno", "filename", "traceback"))
+        limit = self.number(params, "limit", 30, 1, 1000, int)
+        # Allocations of tracemalloc itself and of imports are noise here
+        filters = (tracemalloc.Filter(False, tracemalloc.__file__), tracemalloc.Filter(False, "<frozen importlib._bootstrap*>"))
+        statistics = snapshot.filter_traces(filters).compare_to(baseline.filter_traces(filters), groupBy)
+        current, peak = tracemalloc.get_traced_memory()
+        lines = [f"Top {limit} allocation differences by {groupBy}, traced now {current / 2**20:.1f} MiB, peak {peak / 2**20:.1f} MiB", ""]
+        for statistic in statistics[:limit]:
+            lines.append(str(statistic))
+            if groupBy == "traceback":
+                lines += ["    " + line for line in statistic.traceback.format()]
+        return lines
+
+    async def profile_memory(self, params):
+        if self.memoryBaseline is not None:
+            return self.text(self.memory_statistics(self.memoryBaseline, tracemalloc.take_snapshot(), params))
+
+        seconds = self.number(params, "seconds", 10, 0.1, self.maxDuration)
+        frames = self.number(params, "frames", 25, 1, 100, int)
+        if self.memoryLock.locked():
+            raise HTTPException(status_code=409, detail="A memory profile is already running")
+        async with self.memoryLock:
+            # Tracing slows every allocation down, so it only runs for the requested window
+            startedTracing = not tracemalloc.is_tracing()
+            if startedTracing:
+                tracemalloc.start(frames)
+            try:
+                baseline = tracemalloc.take_snapshot()
+                await asyncio.sleep(seconds)
+                lines = self.memory_statistics(baseline, tracemalloc.take_snapshot(), params)
+            finally:
+                if startedTracing:
+                    tracemalloc.stop()
+        return self.text([f"tracemalloc over {seconds:g}s, worker {self.workerId} (pid {os.getpid()})"] + lines)
+
+    async def start_memory_trace(self, params):
+        frames = self.number(params, "frames", 25, 1, 100, int)
+        if self.memoryBaseline is not None or self.memoryLock.locked():
+            raise HTTPException(status_code=409, detail="A memory profile is already running")
+        self.memoryStartedTracing = not tracemalloc.is_tracing()
+        if self.memoryStartedTracing:
+            tracemalloc.start(frames)
+        self.memoryBaseline = tracemalloc.take_snapshot()
+        return self.text([f"tracemalloc started with {frames} frames, GET memory for the differences and POST memory/stop to end it"])
+
+    async def stop_memory_trace(self, params):
+        if self.memoryBaseline is None:
+            raise HTTPException(status_code=409, detail="No memory profile is running")
+        self.memoryBaseline = None
+        if self.memoryStartedTracing:
+            tracemalloc.stop()
+            self.memoryStartedTracing = False
+        return self.text(["tracemalloc stopped"])
+
+    async def dump_tasks(self, params):
+        limit = self.number(params, "limit", 20, 1, 1000, int)
+        tasks = asyncio.all_tasks()
+        byCoroutine = collections.Counter(getattr(task.get_coro(), "__qualname__", repr(task.get_coro())) for task in tasks)
+        lines = [f"{len(tasks)} asyncio tasks in worker {self.workerId} (pid {os.getpid()})", ""]
+        lines += [f"{count:>6} {name}" for name, count in byCoroutine.most_common()]
+        lines.append("")
+        for task in sorted(tasks, key=lambda task: task.get_name()):
+            stack = io.StringIO()
+            task.print_stack(limit=limit, file=stack)
+            lines.append(stack.getvalue())
+        return self.text(lines)
@@ -0,0 +1,163 @@
+import asyncio
+import bisect
+import os
+import time
+
+from fastapi import Response
+from starlette.routing import Match
+
+
+class HTTP_METRICS():
+    """Prometheus style metrics for an HTTP_SERVER, exposed on /metrics.
+
+    Records per-route request counts, in-flight gauges and latency histograms with fixed
+    buckets, plus event-loop lag. The middleware is plain ASGI and only does a dict
+    lookup, a bisect and a few integer increments per request.
+    Every worker of a multi-worker service keeps its own metrics, so every series carries a
+    worker label: a scrape reaches one worker, and without the label each worker's counters
+    would look like resets of the others'. Sum over worker in queries, e.g.
+    sum without (worker) (rate(http_requests_total[1m])).
+    """
+
+    DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+    MAX_CACHED_PATHS = 10000
+
+    def __init__(self, buckets=DEFAULT_BUCKETS, loopLagInterval=0.5, metricsPath="/metrics"):
+        self.buckets = tuple(sorted(buckets))
+        self.loopLagInterval = loopLagInterval
+        self.metricsPath = metricsPath
+        self.router = None
+        self.workerLabel = f'worker="{os.environ.get("HTTP_SERVER_WORKER_ID", "0")}"'
+
+        self.routeCache = {}  # (method, path) -> route template, keeps label cardinality bounded
+        self.requestCounts = {}  # (method, route, status) -> count
+        self.inFlight = {}  # (method, route) -> gauge
+        self.latencyBuckets = {}  # (method, route) -> per bucket counts (+Inf last)
+        self.latencySums = {}
+
+        self.loopLag = 0.0
+        self.loopLagMax = 0.0
+        self.loopLagTask = None
+
+    def install(self, app):
+        self.router = app.router
+        app.add_middleware(HTTP_METRICS_MIDDLEWARE, metrics=self)
+        app.add_api_route(self.metricsPath, self.metrics_endpoint, methods=["GET"], include_in_schema=False)
+
+    def resolve_route(self, scope):
+        key = (scope["method"], scope["path"])
+        route = self.routeCache.get(key)
+        if route is not None:
+            return route
+
+        route = "<unmatched>"
+        for candidate in self.router.routes:
+            match, _ = candidate.matches(scope)
+            if match != Match.NONE:
+                route = getattr(candidate, "path", route)
+                if match == Match.FULL:
+                    break
+
+        if len(self.routeCache) >= self.MAX_CACHED_PATHS:
+            self.routeCache.clear()
+        self.routeCache[key] = route
+        return route
+
+    def observe(self, method, route, status, duration):
+        countKey = (method, route, status)
+        self.requestCounts[countKey] = self.requestCounts.get(countKey, 0) + 1
+
+        latencyKey = (method, route)
+        counts = self.latencyBuckets.get(latencyKey)
+        if counts is None:
+            counts = self.latencyBuckets[latencyKey] = [0] * (len(self.buckets) + 1)
+            self.latencySums[latencyKey] = 0.0
+        counts[bisect.bisect_left(self.buckets, duration)] += 1
+        self.latencySums[latencyKey] += duration
+
+    def ensure_loop_lag_monitor(self):
+        if self.loopLagTask is None:
+            self.loopLagTask = asyncio.get_running_loop().create_task(self.monitor_loop_lag())
+
+    async def monitor_loop_lag(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            expected = loop.time() + self.loopLagInterval
+            await asyncio.sleep(self.loopLagInterval)
+            self.loopLag = max(0.0, loop.time() - expected)
+            self.loopLagMax = max(self.loopLagMax, self.loopLag)
+
+    def render(self):
+        lines = [
+            "# HELP http_requests_total Total HTTP requests by method, route and status.",
+            "# TYPE http_requests_total counter",
+        ]
+        for (method, route, status), count in self.requestCounts.items():
+            lines.append(f'http_requests_total{{{self.workerLabel},method="{method}",route="{route}",status="{status}"}} {count}')
+
+        lines += [
+            "# HELP http_requests_in_flight HTTP requests currently being handled.",
+            "# TYPE http_requests_in_flight gauge",
+        ]
+        for (method, route), value in self.inFlight.items():
+            lines.append(f'http_requests_in_flight{{{self.workerLabel},method="{method}",route="{route}"}} {value}')
+
+        lines += [
+            "# HELP http_request_duration_seconds HTTP request latency.",
+            "# TYPE http_request_duration_seconds histogram",
+        ]
+        for (method, route), counts in self.latencyBuckets.items():
+            labels = f'{self.workerLabel},method="{method}",route="{route}"'
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                lines.append(f'http_request_duration_seconds_bucket{{{labels},le="{bound}"}} {cumulative}')
+            cumulative += counts[-1]
+            lines.append(f'http_request_duration_seconds_bucket{{{labels},le="+Inf"}} {cumulative}')
+            lines.append(f'http_request_duration_seconds_sum{{{labels}}} {self.latencySums[(method, route)]}')
+            lines.append(f'http_request_duration_seconds_count{{{labels}}} {cumulative}')
+
+        lines += [
+            "# HELP event_loop_lag_seconds Delay of the last event loop lag probe.",
+            "# TYPE event_loop_lag_seconds gauge",
+            f"event_loop_lag_seconds{{{self.workerLabel}}} {self.loopLag}",
+            "# HELP event_loop_lag_max_seconds Largest event loop lag seen since startup.",
+            "# TYPE event_loop_lag_max_seconds gauge",
+            f"event_loop_lag_max_seconds{{{self.workerLabel}}} {self.loopLagMax}",
+        ]
+        return "\n".join(lines) + "\n"
+
+    async def metrics_endpoint(self):
+        return Response(content=self.render(), media_type="text/plain; version=0.0.4")
+
+
+class HTTP_METRICS_MIDDLEWARE():
+    def __init__(self, app, metrics):
+        self.app = app
+        self.metrics = metrics
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        metrics = self.metrics
+        metrics.ensure_loop_lag_monitor()
+        method = scope["method"]
+        route = metrics.resolve_route(scope)
+        inFlightKey = (method, route)
+        metrics.inFlight[inFlightKey] = metrics.inFlight.get(inFlightKey, 0) + 1
+
+        status = 500
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            metrics.inFlight[inFlightKey] -= 1
+            metrics.observe(method, route, status, time.perf_counter() - start)
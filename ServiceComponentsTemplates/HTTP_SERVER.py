@@ -1,5 +1,23 @@
 import asyncio
-from fastapi import FastAPI
+import dataclasses
+import datetime
+import decimal
+import enum
+import errno
+import hashlib
+import importlib.util
+import json
+import math
+import os
+import pathlib
+import signal
+import socket
+import sys
+import tempfile
+import threading
+import uuid
+
+from fastapi import FastAPI, Response
 import uvicorn
 
 from dotenv import load_dotenv
@@ -7,23 +25,230 @@ load_dotenv()
 
 
 from fastapi.middleware.cors import CORSMiddleware
+from starlette.routing import WebSocketRoute
+
+
+class JSON_RESPONSE(Response):
+    """JSON response encoded by orjson or msgspec when installed, by the stdlib json module otherwise.
+
+    It is the default response class, so the dicts routes return are encoded by it after
+    FastAPI's generic jsonable_encoder pass. Returning JSON_RESPONSE(content) skips that pass,
+    the encoder takes dicts, lists, dataclasses, datetimes, UUIDs and enums as they are
+    (orjson encodes dataclasses without slots=True several times faster):
+
+        @dataclasses.dataclass
+        class UserModel:
+            userId: int
+            name: str
+
+        @self.app.get("/api/users/")
+        async def get_api_users():
+            return JSON_RESPONSE([UserModel(1, "Ada"), UserModel(2, "Linus")])
+
+    Content orjson or msgspec cannot encode, like an int over 64 bits, is encoded again by the
+    stdlib json module. Every encoder writes NaN and Infinity as null, where Starlette's
+    JSONResponse raises ValueError.
+    """
+
+    media_type = "application/json"
+    encoderName = "stdlib"
+
+    @classmethod
+    def use(cls, encoderName="auto"):
+        """Select the encoder, auto prefers orjson then msgspec. Returns the name of the encoder in use."""
+        if encoderName in ("auto", "orjson"):
+            try:
+                import orjson
+                options = orjson.OPT_NON_STR_KEYS
+                cls.encode = staticmethod(lambda content: orjson.dumps(content, default=cls.fallback, option=options))
+                cls.encoderName = "orjson"
+                return cls.encoderName
+            except ImportError:
+                pass
+        if encoderName in ("auto", "msgspec"):
+            try:
+                import msgspec
+                cls.encode = staticmethod(msgspec.json.Encoder(enc_hook=cls.fallback, decimal_format="number").encode)
+                cls.encoderName = "msgspec"
+                return cls.encoderName
+            except ImportError:
+                pass
+        cls.encode = cls.encode_stdlib
+        cls.encoderName = "stdlib"
+        return cls.encoderName
+
+    @classmethod
+    def encode_stdlib(cls, content):
+        # Same output as Starlette's JSONResponse
+        try:
+            return json.dumps(content, default=cls.fallback, ensure_ascii=False, allow_nan=False, separators=(",", ":")).encode("utf-8")
+        except ValueError as e:
+            if "Out of range float" not in str(e):
+                raise
+        # NaN or Infinity somewhere, written as null like orjson and msgspec write them
+        return json.dumps(cls.finite(content), default=lambda value: cls.finite(cls.fallback(value)), ensure_ascii=False, allow_nan=False, separators=(",", ":")).encode("utf-8")
+
+    @classmethod
+    def finite(cls, value):
+        """Copy of value with its NaN and Infinity floats replaced by None."""
+        if isinstance(value, float):
+            return value if math.isfinite(value) else None
+        if isinstance(value, dict):
+            return {key: cls.finite(item) for key, item in value.items()}
+        if isinstance(value, (list, tuple)):
+            return [cls.finite(item) for item in value]
+        return value
+
+    @staticmethod
+    def fallback(value):
+        """Convert the values an encoder does not handle itself, like jsonable_encoder would."""
+        if hasattr(value, "model_dump"):
+            return value.model_dump(mode="json")
+        if dataclasses.is_dataclass(value) and not isinstance(value, type):
+            # Shallow, the encoder converts the field values itself
+            return {field.name: getattr(value, field.name) for field in dataclasses.fields(value)}
+        if isinstance(value, (set, frozenset, tuple)):
+            return list(value)
+        if isinstance(value, decimal.Decimal):
+            return int(value) if value == value.to_integral_value() else float(value)
+        if isinstance(value, (datetime.date, datetime.time)):
+            return value.isoformat()
+        if isinstance(value, enum.Enum):
+            return value.value
+        if isinstance(value, bytes):
+            return value.decode()
+        if isinstance(value, (uuid.UUID, pathlib.PurePath)):
+            return str(value)
+        raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+    def render(self, content):
+        try:
+            return self.encode(content)
+        except TypeError:
+            if self.encoderName == "stdlib":
+                raise
+            # e.g. orjson's "Integer exceeds 64-bit range", the stdlib encoder takes any int
+            return self.encode_stdlib(content)
+
+JSON_RESPONSE.use()
+
+class DRAINING_SERVER(uvicorn.Server):
+    """uvicorn server that stops accepting a moment before it closes the idle connections.
+
+    uvicorn closes every connection without a request in progress as soon as it stops accepting,
+    but a keep-alive client may be sending its next request at that moment, or a connection accepted
+    just before may hold its unread request: closing them resets the client. While draining, every
+    response is sent with "Connection: close" instead, and the client reconnects to the instance
+    that took the listeners over.
+    """
+
+    drainDelay = 0.5
 
+    def __init__(self, config):
+        super().__init__(config)
+        self.draining = False
+        self.app = config.loaded_app
+        config.loaded_app = self.close_connections_when_draining
+
+    async def close_connections_when_draining(self, scope, receive, send):
+        if not self.draining or scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        async def send_with_connection_close(message):
+            if message["type"] == "http.response.start":
+                message = {**message, "headers": [*message.get("headers", []), (b"connection", b"close")]}
+            await send(message)
+        await self.app(scope, receive, send_with_connection_close)
+
+    async def shutdown(self, sockets=None):
+        for server in self.servers:
+            server.close()
+        self.draining = True
+        for connection in list(self.server_state.connections):
+            if connection.cycle is not None and not connection.cycle.response_complete:
+                connection.shutdown()  # Closes once its response is sent
+        await asyncio.sleep(self.drainDelay)
+        await super().shutdown(sockets)
 
 class HTTP_SERVER():
-    def __init__(self, httpServerHost, httpServerPort, httpServerPrivilegedIpAddress=["127.0.0.1"], data_class_instance=None):
-        self.app = FastAPI()
+    # Mirrors "ServiceHttpTuning" in services.json, None means no limit
+    DEFAULT_TUNING = {"Loop": "auto", "Http": "auto", "Json": "auto", "Backlog": 2048, "KeepAliveTimeout": 5, "LimitConcurrency": None, "MaxRequests": None}
+    # Hand-over and probe sockets of the running instances, start-server.py looks for the probe sockets here
+    INSTANCE_SOCKET_DIR = os.path.join(tempfile.gettempdir(), "microservice-instances")
+
+    def __init__(self, httpServerHost, httpServerPort, httpServerPrivilegedIpAddress=["127.0.0.1"], data_class_instance=None, httpServerWorkers=1, httpServerUnixSocket=None, httpServerTcp=True, httpServerTuning=None, httpServerWsPort=None):
+        self.tuning = {**HTTP_SERVER.DEFAULT_TUNING, **(httpServerTuning or {})}
+        JSON_RESPONSE.use(self.tuning["Json"])
+        self.app = FastAPI(default_response_class=JSON_RESPONSE)
         self.host = httpServerHost
         self.port = httpServerPort
+        # Extra TCP listener for WebSocket clients, None accepts them on the HTTP port
+        self.wsPort = httpServerWsPort
+
+        # Co-located services can call through the Unix domain socket and skip the TCP stack
+        self.unixSocketPath = httpServerUnixSocket
+        self.unixSocketInode = None  # Set when this process created the socket file and must remove it
+        self.tcpEnabled = httpServerTcp or httpServerUnixSocket is None
+
+        # The next instance of this service takes the TCP listeners over through this socket (rolling restarts).
+        # The service file's path names the project and the service, so another service or project never
+        # reaches it, whatever port it is configured with
+        self.serviceIdentity = os.path.realpath(sys.argv[0])
+        self.handoffPath = os.path.join(HTTP_SERVER.INSTANCE_SOCKET_DIR, f"{hashlib.sha256(self.serviceIdentity.encode()).hexdigest()[:16]}.handoff")
+        # Set by restart-server.py for the new instance only: any other start must fail on a port in use
+        self.rollingStart = os.environ.get("HTTP_SERVER_ROLLING_START") == "1"
+        self.handoffInode = None
+        self.probeSocketPath = None
+
+        # 0 means one worker per CPU core
+        self.workers = httpServerWorkers or os.cpu_count() or 1
+        self.workerShutdownTimeout = 30
 
         self.privilegedIpAddress = httpServerPrivilegedIpAddress
 
+        #<HTTP_SERVER_PRIVILEGED_IP_FILTER_START>
+        #<HTTP_SERVER_PRIVILEGED_IP_FILTER_END>
+
+        # Created before the components that propagate the trace context through it
+        #<HTTP_SERVER_TRACER_START>
+        #<HTTP_SERVER_TRACER_END>
+
         #<HTTP_SERVER_CORS_ADDITION_START>
         self.app.add_middleware(CORSMiddleware, allow_origins=["*"],allow_credentials=True,allow_methods=["*"],allow_headers=["*"],)
         #<HTTP_SERVER_CORS_ADDITION_END>
 
+        #<HTTP_SERVER_METRICS_START>
+        #<HTTP_SERVER_METRICS_END>
+
+        #<HTTP_SERVER_RESPONSE_CACHE_START>
+        #<HTTP_SERVER_RESPONSE_CACHE_END>
+
+        #<HTTP_SERVER_SERVICE_CLIENT_START>
+        #<HTTP_SERVER_SERVICE_CLIENT_END>
+
+        #<HTTP_SERVER_MONGODB_START>
+        #<HTTP_SERVER_MONGODB_END>
+
+        #<HTTP_SERVER_LOGGER_START>
+        #<HTTP_SERVER_LOGGER_END>
+
+        #<HTTP_SERVER_WS_HUB_START>
+        #<HTTP_SERVER_WS_HUB_END>
+
+        #<HTTP_SERVER_DEBUG_PROFILER_START>
+        #<HTTP_SERVER_DEBUG_PROFILER_END>
+
+        # Added last so it is the outermost middleware and rejects before any other work is done
+        #<HTTP_SERVER_ADMISSION_CONTROL_START>
+        #<HTTP_SERVER_ADMISSION_CONTROL_END>
+
         self.data_class = data_class_instance  # Reference to the Data class instance
 
     async def configure_routes(self):
+        #<HTTP_SERVER_WS_EVENTS_START>
+        #<HTTP_SERVER_WS_EVENTS_END>
+
 
         #<HTTP_SERVER_API_{/api/sample/}_START>
 
@@ -34,7 +259,7 @@ class HTTP_SERVER():
         #<HTTP_SERVER_FUNCTION_{/api/sample/}_START>
         async def get_api_sample():
             print("Running Through Someone Else")
-            return {"message": "Hello World"}
+            return JSON_RESPONSE({"message": "Hello World"})
         #<HTTP_SERVER_FUNCTION_{/api/sample/}_END>
 
         #<HTTP_SERVER_API_{/api/sample/}_END>
@@ -42,10 +267,287 @@ class HTTP_SERVER():
         #<HTTP_SERVER_NEW_API_START>
         #<HTTP_SERVER_NEW_API_END>
 
+    def is_supervisor(self):
+        """True in the process that only supervises the workers of a multi-worker service."""
+        return self.workers > 1 and os.environ.get("HTTP_SERVER_WORKER_ID") is None
+
     async def run_app(self):
-        config = uvicorn.Config(self.app, host=self.host, port=self.port)
-        server = uvicorn.Server(config)
-        await server.serve()
+        if self.is_supervisor():
+            await self.supervise_workers()
+            return
+
+        if os.environ.get("HTTP_SERVER_WORKER_ID") is None:
+            listeners = self.open_listeners()
+            # uvicorn re-raises SIGTERM once it has stopped, so clean up during the application shutdown
+            self.app.router.on_shutdown.append(self.remove_instance_sockets)
+        else:
+            listeners = self.inherited_listeners()
+
+        maxRequests = self.tuning["MaxRequests"]
+        config = uvicorn.Config(
+            self.app,
+            host=self.host,
+            port=self.port,
+            http=self.resolve_http_implementation(),
+            backlog=self.tuning["Backlog"],
+            timeout_keep_alive=self.tuning["KeepAliveTimeout"],
+            limit_concurrency=self.tuning["LimitConcurrency"],
+            limit_max_requests=maxRequests,
+            # Spread the recycling so the workers of a service do not all restart at once
+            limit_max_requests_jitter=maxRequests // 10 if maxRequests else 0,
+        )
+        config.load()
+        if os.environ.get("HTTP_SERVER_WORKER_ID", "0") == "0":
+            self.report_server_setup(config)
+
+        server = DRAINING_SERVER(config)
+        await server.serve(sockets=list(listeners.values()))
+
+    @staticmethod
+    def select_event_loop(loopName):
+        """Return the loop factory for asyncio.Runner: uvloop when asked for (or with auto, when installed), else the default loop."""
+        if loopName in ("auto", "uvloop"):
+            try:
+                import uvloop
+                return uvloop.new_event_loop
+            except ImportError:
+                pass
+        return None
+
+    def resolve_http_implementation(self):
+        # uvicorn fails to start if the requested parser is missing, fall back and let the self-check report it
+        if self.tuning["Http"] == "httptools" and importlib.util.find_spec("httptools") is None:
+            return "auto"
+        return self.tuning["Http"]
+
+    def report_server_setup(self, config):
+        """Print the event loop, HTTP parser and limits this service actually runs with."""
+        loopName = "uvloop" if type(asyncio.get_running_loop()).__module__.startswith("uvloop") else "asyncio"
+        httpName = "httptools" if config.http_protocol_class.__name__.startswith("HttpTools") else "h11"
+        print(f"Event loop: {loopName} (requested {self.tuning['Loop']})")
+        print(f"HTTP parser: {httpName} (requested {self.tuning['Http']})")
+        print(f"JSON encoder: {JSON_RESPONSE.encoderName} (requested {self.tuning['Json']})")
+        print(f"Backlog: {config.backlog}, keep-alive: {config.timeout_keep_alive}s, limit concurrency: {config.limit_concurrency}, max requests: {config.limit_max_requests}")
+
+        if self.tuning["Loop"] in ("auto", "uvloop") and loopName != "uvloop":
+            print("WARNING: uvloop is not installed, the service runs on the slower default asyncio loop")
+        if self.tuning["Http"] in ("auto", "httptools") and httpName != "httptools":
+            print("WARNING: httptools is not installed, requests are parsed by the slower h11")
+        if self.tuning["Json"] == "auto" and JSON_RESPONSE.encoderName == "stdlib":
+            print("WARNING: neither orjson nor msgspec is installed, responses are encoded by the slower stdlib json")
+        elif self.tuning["Json"] not in ("auto", JSON_RESPONSE.encoderName):
+            print(f"WARNING: {self.tuning['Json']} is not installed, responses are encoded by the slower stdlib json")
+        if config.limit_max_requests and self.workers == 1:
+            print("WARNING: with a single worker the service exits after max requests, run it with workers or under start-server.py --supervise")
+
+        if any(isinstance(route, WebSocketRoute) for route in self.app.routes):
+            if config.ws_protocol_class is None:
+                print("WARNING: neither websockets nor wsproto is installed, WebSocket connections are refused")
+            if self.workers > 1:
+                print("WARNING: every worker has its own WebSocket connections and rooms, a broadcast only reaches the clients of the worker sending it")
+
+    def open_listeners(self):
+        """Return {name: socket} of this instance's listeners: "http" and "ws" over TCP, "unix" and "probe".
+
+        In a rolling start the TCP listeners of the instance already running are taken over, so both
+        instances accept from the same queues and stopping the old instance resets none of the
+        connections queued there. The probe socket belongs to this instance only, restart-server.py
+        checks through it that the new instance serves before stopping the old one.
+        """
+        os.makedirs(HTTP_SERVER.INSTANCE_SOCKET_DIR, mode=0o700, exist_ok=True)
+        handedOver = self.receive_listeners() if self.rollingStart else {}
+        listeners = {}
+        if self.tcpEnabled:
+            listeners["http"] = handedOver.pop("http", None) or self.bind_socket()
+        if self.wsPort is not None:
+            listeners["ws"] = handedOver.pop("ws", None) or self.bind_socket(self.wsPort)
+        for sock in handedOver.values():
+            sock.close()  # A listener the new configuration no longer has
+        if listeners:
+            self.serve_handoff(listeners)
+        if self.unixSocketPath is not None:
+            listeners["unix"] = self.bind_unix_socket()
+        listeners["probe"] = self.bind_probe_socket()
+        return listeners
+
+    def inherited_listeners(self):
+        """Return {name: socket} of the listeners opened by the worker supervisor, passed as name:fd pairs."""
+        pairs = [pair.split(":") for pair in os.environ["HTTP_SERVER_WORKER_FDS"].split(",")]
+        return {name: socket.socket(fileno=int(fd)) for name, fd in pairs}
+
+    def bind_socket(self, port=None):
+        """Return a new TCP listener on the HTTP port (or port).
+
+        Only a rolling start binds with SO_REUSEPORT, to start next to an old instance that cannot hand
+        its listeners over (one started before the hand-over existed). Any other start fails with
+        EADDRINUSE when something already listens on the port.
+        """
+        family = socket.AF_INET6 if ":" in self.host else socket.AF_INET
+        # asyncio only enables TCP_NODELAY on accepted sockets whose protocol is IPPROTO_TCP,
+        # without it keep-alive responses stall on Nagle and delayed ACKs (~40ms)
+        sock = socket.socket(family, socket.SOCK_STREAM, socket.IPPROTO_TCP)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if self.rollingStart and hasattr(socket, "SO_REUSEPORT"):
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        sock.bind((self.host, self.port if port is None else port))
+        return sock
+
+    def receive_listeners(self):
+        """Return {name: socket} of the TCP listeners the running instance hands over, empty when none does."""
+        try:
+            with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as connection:
+                connection.settimeout(5)
+                connection.connect(self.handoffPath)
+                message, fds, _, _ = socket.recv_fds(connection, 4096, 4)
+        except OSError:
+            return {}  # No instance is running, or it was started before the hand-over existed
+
+        identity, _, names = message.decode().partition("\n")
+        if identity != self.serviceIdentity:
+            for fd in fds:
+                os.close(fd)
+            print(f"WARNING: {self.handoffPath} is served by {identity or 'an unknown service'}, not taking its listeners over")
+            return {}
+        listeners = {}
+        for name, fd in zip(names.split(","), fds):
+            sock = socket.socket(fileno=fd)
+            port = self.port if name == "http" else self.wsPort
+            addresses = {info[4][:2] for info in socket.getaddrinfo(self.host, port, type=socket.SOCK_STREAM)} if port else set()
+            if sock.getsockname()[:2] in addresses:
+                listeners[name] = sock
+            else:
+                sock.close()  # The host or port changed, bound anew
+        return listeners
+
+    def serve_handoff(self, listeners):
+        """Hand the TCP listeners to the next instance of this service, from a thread for as long as this one runs."""
+        # Duplicates stay open while this instance drains, uvicorn closes its sockets when it stops accepting
+        listeners = {name: sock.dup() for name, sock in listeners.items()}
+        handoff, self.handoffInode = self.bind_renamed_unix_socket(self.handoffPath, 8)
+        threading.Thread(target=self.hand_over_listeners, args=(handoff, listeners), name="HTTP_SERVER hand-over", daemon=True).start()
+
+    def hand_over_listeners(self, handoff, listeners):
+        message = f"{self.serviceIdentity}\n{','.join(listeners)}".encode()
+        fds = [sock.fileno() for sock in listeners.values()]
+        while True:
+            connection, _ = handoff.accept()
+            with connection:
+                try:
+                    socket.send_fds(connection, [message], fds)
+                except OSError:
+                    pass  # The new instance gave up, the next one asks again
+
+    def bind_unix_socket(self):
+        """Return the Unix domain socket listener.
+
+        The socket is bound to a temporary name and renamed over the configured path, so a new
+        instance started by restart-server.py takes over new connections while the old one drains.
+        Any other start fails when a process still accepts on the path.
+        """
+        if not self.rollingStart and os.path.exists(self.unixSocketPath):
+            with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as probe:
+                try:
+                    probe.connect(self.unixSocketPath)
+                except OSError:
+                    pass  # Left behind by a stopped instance, replaced below
+                else:
+                    raise OSError(errno.EADDRINUSE, f"{self.unixSocketPath} is already served by another process")
+        sock, self.unixSocketInode = self.bind_renamed_unix_socket(self.unixSocketPath, self.tuning["Backlog"])
+        return sock
+
+    def bind_renamed_unix_socket(self, path, backlog):
+        """Bind a Unix socket to a temporary name and rename it over path, return the socket and the inode of path."""
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        temporaryPath = f"{path}.{os.getpid()}"
+        if os.path.exists(temporaryPath):
+            os.unlink(temporaryPath)
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.bind(temporaryPath)
+        # Listen before taking over the path, connections then queue until they are accepted
+        sock.listen(backlog)
+        os.replace(temporaryPath, path)
+        return sock, os.stat(path).st_ino
+
+    def bind_probe_socket(self):
+        self.probeSocketPath = os.path.join(HTTP_SERVER.INSTANCE_SOCKET_DIR, f"{os.getpid()}.probe")
+        if os.path.exists(self.probeSocketPath):
+            os.unlink(self.probeSocketPath)  # Left behind by a crashed process with the same PID
+        # Not listening yet, connecting fails until uvicorn serves on it
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.bind(self.probeSocketPath)
+        return sock
+
+    def remove_instance_sockets(self):
+        # Only remove the socket files a newer instance has not replaced
+        for path, inode in ((self.unixSocketPath, self.unixSocketInode), (self.handoffPath, self.handoffInode)):
+            try:
+                if inode is not None and os.stat(path).st_ino == inode:
+                    os.unlink(path)
+            except FileNotFoundError:
+                pass
+        self.unixSocketInode = None
+        self.handoffInode = None
+        if self.probeSocketPath is not None and os.path.exists(self.probeSocketPath):
+            os.unlink(self.probeSocketPath)
+        self.probeSocketPath = None
+
+    async def supervise_workers(self):
+        """Start one process per worker, each running this service with its own Data instance, and stop them gracefully on SIGINT/SIGTERM."""
+        # Pre-forked: every worker accepts on the listeners opened here, so neither a worker recycled after
+        # MaxRequests nor a rolling restart closes a socket with connections still queued on it (they would be reset)
+        listeners = self.open_listeners()
+        for name, sock in listeners.items():
+            if name in ("http", "ws"):
+                # Connections queue while the workers start
+                sock.listen(self.tuning["Backlog"])
+            sock.set_inheritable(True)
+        workerEnv = dict(os.environ, HTTP_SERVER_WORKER_FDS=",".join(f"{name}:{sock.fileno()}" for name, sock in listeners.items()))
+        passFds = tuple(sock.fileno() for sock in listeners.values())
+
+        workers = [await self.spawn_worker(workerId, workerEnv, passFds) for workerId in range(self.workers)]
+        addresses = [f"{self.host}:{self.port}"] if self.tcpEnabled else []
+        if self.wsPort is not None:
+            addresses.append(f"{self.host}:{self.wsPort} (WebSocket)")
+        if self.unixSocketPath is not None:
+            addresses.append(f"unix:{self.unixSocketPath}")
+        print(f"Started {len(workers)} workers on {', '.join(addresses)}: {[worker.pid for worker in workers]}")
+
+        stopRequested = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, stopRequested.set)
+
+        stopWaiter = asyncio.create_task(stopRequested.wait())
+        while not stopRequested.is_set():
+            workerExits = {asyncio.create_task(worker.wait()): workerId for workerId, worker in enumerate(workers) if worker.returncode is None}
+            if not workerExits:
+                break
+            done, _ = await asyncio.wait([stopWaiter, *workerExits], return_when=asyncio.FIRST_COMPLETED)
+            for task in workerExits:
+                task.cancel()
+            for task in done:
+                workerId = workerExits.get(task)
+                # A clean exit is a worker recycled after MaxRequests, anything else stays down
+                if workerId is not None and workers[workerId].returncode == 0 and self.tuning["MaxRequests"] and not stopRequested.is_set():
+                    workers[workerId] = await self.spawn_worker(workerId, workerEnv, passFds)
+        stopWaiter.cancel()
+
+        workerExits = [asyncio.create_task(worker.wait()) for worker in workers]
+
+        # uvicorn drains in-flight requests on SIGTERM, anything still alive after the timeout is killed
+        for worker in workers:
+            if worker.returncode is None:
+                worker.send_signal(signal.SIGTERM)
+        await asyncio.wait(workerExits, timeout=self.workerShutdownTimeout)
+        for worker in workers:
+            if worker.returncode is None:
+                worker.kill()
+        await asyncio.gather(*workerExits)
+        self.remove_instance_sockets()
+
+    async def spawn_worker(self, workerId, workerEnv, passFds):
+        workerEnv = dict(workerEnv, HTTP_SERVER_WORKER_ID=str(workerId))
+        return await asyncio.create_subprocess_exec(sys.executable, *sys.argv, env=workerEnv, pass_fds=passFds)
 
 async def start_server():
     server = HTTP_SERVER('127.0.0.1', 8000,[])
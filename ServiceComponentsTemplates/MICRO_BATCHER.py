@@ -0,0 +1,103 @@
+import asyncio
+import functools
+
+
+class MICRO_BATCHER():
+    """Turns a batch handler into a per-item awaitable, so concurrent requests share one backend call.
+
+    Items are collected until maxBatchSize are waiting or maxWait seconds passed since the first
+    one, then the handler is called once with the list and each caller gets its own result back.
+    The handler returns the results in the same order; an Exception instance in place of a
+    result fails only that item. Equal (hashable) items in one batch are sent only once.
+
+        @MICRO_BATCHER.batched(maxBatchSize=64, maxWait=0.005)
+        async def load_users(userIds):
+            return await fetch_users_in_one_query(userIds)
+
+        @self.app.get("/api/user/")
+        async def get_api_user(userId: int):
+            return await load_users(userId)
+    """
+
+    def __init__(self, batchHandler, maxBatchSize=64, maxWait=0.005, maxConcurrentBatches=None):
+        self.batchHandler = batchHandler
+        self.maxBatchSize = maxBatchSize
+        self.maxWait = maxWait
+        self.batchSemaphore = asyncio.Semaphore(maxConcurrentBatches) if maxConcurrentBatches else None
+
+        self.pending = {}  # item -> futures of the callers waiting for it
+        self.flushTimer = None
+        self.batchTasks = set()  # Keeps running batches referenced until they finish
+        self.batches = 0
+        self.items = 0
+
+    @classmethod
+    def batched(cls, maxBatchSize=64, maxWait=0.005, maxConcurrentBatches=None):
+        def decorator(batchHandler):
+            return functools.update_wrapper(cls(batchHandler, maxBatchSize, maxWait, maxConcurrentBatches), batchHandler)
+        return decorator
+
+    async def __call__(self, item):
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        try:
+            waiters = self.pending.setdefault(item, [])
+        except TypeError:
+            # Unhashable items cannot be deduplicated, give them a key of their own
+            waiters = self.pending.setdefault(_UnhashableItem(item), [])
+        waiters.append(future)
+
+        if len(self.pending) >= self.maxBatchSize:
+            self.dispatch()
+        elif self.flushTimer is None:
+            self.flushTimer = loop.call_later(self.maxWait, self.dispatch)
+        return await future
+
+    def dispatch(self):
+        if self.flushTimer is not None:
+            self.flushTimer.cancel()
+            self.flushTimer = None
+        if not self.pending:
+            return
+
+        batch, self.pending = self.pending, {}
+        task = asyncio.get_running_loop().create_task(self.run_batch(batch))
+        self.batchTasks.add(task)
+        task.add_done_callback(self.batchTasks.discard)
+
+    async def run_batch(self, batch):
+        items = [item.value if isinstance(item, _UnhashableItem) else item for item in batch]
+        self.batches += 1
+        self.items += len(items)
+        try:
+            if self.batchSemaphore is not None:
+                async with self.batchSemaphore:
+                    results = await self.batchHandler(items)
+            else:
+                results = await self.batchHandler(items)
+            results = list(results)
+            if len(results) != len(items):
+                raise ValueError(f"{self.batchHandler.__name__} returned {len(results)} results for {len(items)} items")
+        except Exception as e:
+            for waiters in batch.values():
+                for future in waiters:
+                    if not future.done():
+                        future.set_exception(e)
+            return
+
+        for waiters, result in zip(batch.values(), results):
+            for future in waiters:
+                # The caller may have gone away (client disconnected) while the batch ran
+                if future.done():
+                    continue
+                if isinstance(result, Exception):
+                    future.set_exception(result)
+                else:
+                    future.set_result(result)
+
+
+class _UnhashableItem():
+    __slots__ = ("value",)
+
+    def __init__(self, value):
+        self.value = value
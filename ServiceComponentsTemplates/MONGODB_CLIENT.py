@@ -0,0 +1,152 @@
+import asyncio
+import functools
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import pymongo
+from pymongo.errors import BulkWriteError
+
+
+class MONGODB_CLIENT():
+    """MongoDB access for async route handlers without blocking the event loop.
+
+    One pooled pymongo client is shared by the whole service and every call runs on a
+    thread pool sized to that pool. The *_later methods buffer writes per collection and
+    flush them as ordered bulk_write batches, in the order they were buffered, once
+    flushSize operations are waiting or flushInterval seconds have passed:
+
+        user = await self.mongoDb.find_one("users", {"_id": userId})
+        await self.mongoDb.insert_later("events", {"type": "login", "userId": userId})
+
+    Pass client to use another pymongo compatible client, e.g. mongomock.MongoClient().
+    """
+
+    def __init__(self, databaseName, mongoUrl=None, maxPoolSize=100, flushSize=500, flushInterval=0.05, maxBufferedOperations=10000, client=None):
+        mongoUrl = mongoUrl or os.getenv("MONGODB_URL", "mongodb://127.0.0.1:27017")
+        self.client = client if client is not None else pymongo.MongoClient(mongoUrl, maxPoolSize=maxPoolSize)
+        self.database = self.client[databaseName]
+        # More threads than pooled connections would only queue inside pymongo
+        self.executor = ThreadPoolExecutor(max_workers=maxPoolSize, thread_name_prefix="mongodb")
+
+        self.flushSize = flushSize
+        self.flushInterval = flushInterval
+        self.maxBufferedOperations = maxBufferedOperations
+        self.buffers = {}  # collection name -> pending write operations
+        self.bufferedCount = 0
+        self.flushRequested = None
+        self.flushTask = None
+        self.flushLock = None
+        self.failedWrites = 0
+
+    async def run(self, function, *args, **kwargs):
+        """Run a blocking pymongo call on the thread pool."""
+        return await asyncio.get_running_loop().run_in_executor(self.executor, functools.partial(function, *args, **kwargs))
+
+    async def find_one(self, collectionName, filter=None, **kwargs):
+        return await self.run(self.database[collectionName].find_one, filter, **kwargs)
+
+    async def find(self, collectionName, filter=None, limit=0, **kwargs):
+        # The cursor is drained on the pool too, iterating it on the loop would block
+        return await self.run(lambda: list(self.database[collectionName].find(filter, limit=limit, **kwargs)))
+
+    async def count_documents(self, collectionName, filter):
+        return await self.run(self.database[collectionName].count_documents, filter)
+
+    async def aggregate(self, collectionName, pipeline):
+        return await self.run(lambda: list(self.database[collectionName].aggregate(pipeline)))
+
+    async def insert_one(self, collectionName, document):
+        return await self.run(self.database[collectionName].insert_one, document)
+
+    async def update_one(self, collectionName, filter, update, upsert=False):
+        return await self.run(self.database[collectionName].update_one, filter, update, upsert=upsert)
+
+    async def delete_one(self, collectionName, filter):
+        return await self.run(self.database[collectionName].delete_one, filter)
+
+    async def bulk_write(self, collectionName, operations, ordered=False):
+        return await self.run(self.database[collectionName].bulk_write, operations, ordered=ordered)
+
+    async def insert_later(self, collectionName, document):
+        await self.buffer_write(collectionName, pymongo.InsertOne(document))
+
+    async def update_later(self, collectionName, filter, update, upsert=False):
+        await self.buffer_write(collectionName, pymongo.UpdateOne(filter, update, upsert=upsert))
+
+    async def delete_later(self, collectionName, filter):
+        await self.buffer_write(collectionName, pymongo.DeleteOne(filter))
+
+    async def buffer_write(self, collectionName, operation):
+        if self.flushTask is None:
+            self.flushRequested = asyncio.Event()
+            self.flushLock = asyncio.Lock()
+            self.flushTask = asyncio.get_running_loop().create_task(self.flush_periodically())
+
+        if self.bufferedCount >= self.maxBufferedOperations:
+            # Backpressure: the database is not keeping up, write in the caller's time
+            await self.flush()
+
+        self.buffers.setdefault(collectionName, []).append(operation)
+        self.bufferedCount += 1
+        if self.bufferedCount >= self.flushSize:
+            self.flushRequested.set()
+
+    async def flush_periodically(self):
+        while True:
+            try:
+                await asyncio.wait_for(self.flushRequested.wait(), self.flushInterval)
+            except asyncio.TimeoutError:
+                pass
+            self.flushRequested.clear()
+            await self.flush()
+
+    async def flush(self):
+        """Write every buffered operation, the collections concurrently and each one's operations in order."""
+        if self.flushLock is None:
+            return
+        async with self.flushLock:
+            buffers, self.buffers = self.buffers, {}
+            self.bufferedCount = 0
+            results = await asyncio.gather(*[self.write_in_order(collectionName, operations) for collectionName, operations in buffers.items()], return_exceptions=True)
+
+        for (collectionName, operations), result in zip(buffers.items(), results):
+            if isinstance(result, int):
+                if result:
+                    self.failedWrites += result
+                    print(f"MongoDB write-behind: {result} of {len(operations)} writes to {collectionName} failed")
+            elif isinstance(result, Exception):
+                # Nobody awaits a write-behind, report it here and keep the flusher alive
+                self.failedWrites += len(operations)
+                print(f"MongoDB write-behind: {len(operations)} writes to {collectionName} failed: {result}")
+            elif isinstance(result, BaseException):
+                raise result
+
+    async def write_in_order(self, collectionName, operations):
+        """Write operations with ordered bulk_writes and return how many failed.
+
+        pymongo runs an unordered bulk as all its inserts, then its updates, then its deletes, so a
+        delete followed by an insert of the same _id would lose the document. An ordered bulk stops
+        at its first error instead, the operations after the failed one are sent again.
+        """
+        failed = 0
+        while operations:
+            try:
+                await self.bulk_write(collectionName, operations, ordered=True)
+                break
+            except BulkWriteError as e:
+                writeErrors = e.details.get("writeErrors")
+                if not writeErrors:
+                    raise  # Write concern errors, the writes themselves were applied
+                failed += 1
+                operations = operations[writeErrors[0]["index"] + 1:]
+        return failed
+
+    async def close(self):
+        if self.flushTask is not None:
+            # Holding the lock, the flusher can only be cancelled between batches and never loses one
+            async with self.flushLock:
+                self.flushTask.cancel()
+            self.flushTask = None
+        await self.flush()
+        self.executor.shutdown(wait=True)
+        self.client.close()
@@ -0,0 +1,121 @@
+import bisect
+import ipaddress
+
+from starlette.routing import Match
+
+
+class PRIVILEGED_IP_FILTER():
+    """Rejects requests to privileged routes from clients outside httpServerPrivilegedIpAddress.
+
+    The IPs and CIDR ranges are compiled once into sorted, merged integer ranges per
+    address family, so each check is a single bisect however many ranges are allowed.
+    With defaultPrivileged=True every route is restricted unless decorated with
+    @unprivileged, otherwise only routes decorated with @privileged are:
+
+        @self.app.get("/api/admin/")
+        @self.privilegedIpFilter.privileged
+        async def get_api_admin(): ...
+    """
+
+    MAX_CACHED_PATHS = 10000
+    MAX_CACHED_CLIENTS = 10000
+
+    def __init__(self, privilegedIpAddresses, defaultPrivileged=True):
+        self.defaultPrivileged = defaultPrivileged
+        self.ranges = {4: ([], []), 6: ([], [])}  # version -> (starts, ends)
+        self.router = None
+        self.routeCache = {}  # (method, path) -> route requires a privileged client
+        self.clientCache = {}  # client host -> is privileged
+        self.compile(privilegedIpAddresses)
+
+    def compile(self, privilegedIpAddresses):
+        networks = {4: [], 6: []}
+        for entry in privilegedIpAddresses:
+            network = ipaddress.ip_network(entry, strict=False)
+            networks[network.version].append((int(network.network_address), int(network.broadcast_address)))
+
+        for version, intervals in networks.items():
+            starts, ends = [], []
+            for start, end in sorted(intervals):
+                # Merge overlapping and adjacent ranges so the index stays minimal
+                if ends and start <= ends[-1] + 1:
+                    ends[-1] = max(ends[-1], end)
+                else:
+                    starts.append(start)
+                    ends.append(end)
+            self.ranges[version] = (starts, ends)
+
+    def is_privileged_ip(self, host):
+        privileged = self.clientCache.get(host)
+        if privileged is None:
+            if len(self.clientCache) >= self.MAX_CACHED_CLIENTS:
+                self.clientCache.clear()
+            privileged = self.clientCache[host] = self.lookup(host)
+        return privileged
+
+    def lookup(self, host):
+        try:
+            address = ipaddress.ip_address(host)
+        except ValueError:
+            return False
+        if address.version == 6 and address.ipv4_mapped is not None:
+            address = address.ipv4_mapped
+
+        starts, ends = self.ranges[address.version]
+        value = int(address)
+        index = bisect.bisect_right(starts, value) - 1
+        return index >= 0 and value <= ends[index]
+
+    def privileged(self, endpoint):
+        endpoint.__privileged__ = True
+        return endpoint
+
+    def unprivileged(self, endpoint):
+        endpoint.__privileged__ = False
+        return endpoint
+
+    def install(self, app):
+        self.router = app.router
+        app.add_middleware(PRIVILEGED_IP_FILTER_MIDDLEWARE, ipFilter=self)
+
+    def route_requires_privilege(self, scope):
+        key = (scope.get("method", "WEBSOCKET"), scope["path"])
+        requiresPrivilege = self.routeCache.get(key)
+        if requiresPrivilege is not None:
+            return requiresPrivilege
+
+        requiresPrivilege = self.defaultPrivileged
+        for route in self.router.routes:
+            match, _ = route.matches(scope)
+            if match == Match.FULL:
+                requiresPrivilege = getattr(getattr(route, "endpoint", None), "__privileged__", self.defaultPrivileged)
+                break
+
+        if len(self.routeCache) >= self.MAX_CACHED_PATHS:
+            self.routeCache.clear()
+        self.routeCache[key] = requiresPrivilege
+        return requiresPrivilege
+
+
+class PRIVILEGED_IP_FILTER_MIDDLEWARE():
+    def __init__(self, app, ipFilter):
+        self.app = app
+        self.ipFilter = ipFilter
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] not in ("http", "websocket") or not self.ipFilter.route_requires_privilege(scope):
+            await self.app(scope, receive, send)
+            return
+
+        # No peer address means a Unix domain socket, which only local processes can reach
+        client = scope.get("client")
+        host = client[0] if client else "127.0.0.1"
+        if self.ipFilter.is_privileged_ip(host):
+            await self.app(scope, receive, send)
+            return
+
+        if scope["type"] == "websocket":
+            await send({"type": "websocket.close", "code": 1008})
+            return
+        await send({"type": "http.response.start", "status": 403, "headers": [(b"content-type", b"application/json")]})
+        await send({"type": "http.response.body", "body": b'{"detail":"Forbidden"}'})
@@ -0,0 +1,224 @@
+import asyncio
+import collections
+import functools
+import hashlib
+import inspect
+import time
+
+from fastapi import Request, Response
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+
+
+class CACHE_ENTRY():
+    __slots__ = ("body", "mediaType", "etag", "expiresAt")
+
+    def __init__(self, body, mediaType, etag, expiresAt):
+        self.body = body
+        self.mediaType = mediaType
+        self.etag = etag
+        self.expiresAt = expiresAt
+
+    def size(self):
+        return len(self.body) + len(self.mediaType) + len(self.etag)
+
+    def serialize(self):
+        return self.mediaType.encode() + b"\n" + self.etag.encode() + b"\n" + self.body
+
+    @classmethod
+    def deserialize(cls, data, expiresAt):
+        mediaType, etag, body = data.split(b"\n", 2)
+        return cls(body, mediaType.decode(), etag.decode(), expiresAt)
+
+
+class MEMORY_CACHE_BACKEND():
+    """In-process LRU bounded by entry count and total body bytes.
+
+    Also usable as the shared backend stand-in when testing without Redis.
+    """
+
+    def __init__(self, maxEntries=10000, maxBytes=64 * 1024 * 1024):
+        self.maxEntries = maxEntries
+        self.maxBytes = maxBytes
+        self.entries = collections.OrderedDict()
+        self.totalBytes = 0
+
+    async def get(self, key):
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        if entry.expiresAt <= time.monotonic():
+            self.remove(key)
+            return None
+        self.entries.move_to_end(key)
+        return entry
+
+    async def set(self, key, entry):
+        if entry.size() > self.maxBytes:
+            return
+        self.remove(key)
+        self.entries[key] = entry
+        self.totalBytes += entry.size()
+        while len(self.entries) > self.maxEntries or self.totalBytes > self.maxBytes:
+            self.remove(next(iter(self.entries)))
+
+    async def delete(self, key):
+        self.remove(key)
+
+    def remove(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.totalBytes -= entry.size()
+
+
+class REDIS_CACHE_BACKEND():
+    """Shared backend so every worker and instance of a service sees the same cached responses."""
+
+    def __init__(self, redisUrl="redis://127.0.0.1:10000", keyPrefix="response-cache:"):
+        import redis.asyncio  # Optional dependency, only needed when a shared backend is configured
+        self.client = redis.asyncio.from_url(redisUrl)
+        self.keyPrefix = keyPrefix
+
+    async def get(self, key):
+        data, ttl = await self.client.pipeline().get(self.keyPrefix + key).pttl(self.keyPrefix + key).execute()
+        if data is None or ttl <= 0:
+            return None
+        return CACHE_ENTRY.deserialize(data, time.monotonic() + ttl / 1000)
+
+    async def set(self, key, entry):
+        ttl = int((entry.expiresAt - time.monotonic()) * 1000)
+        if ttl > 0:
+            await self.client.set(self.keyPrefix + key, entry.serialize(), px=ttl)
+
+    async def delete(self, key):
+        await self.client.delete(self.keyPrefix + key)
+
+
+class RESPONSE_CACHE():
+    """Caches route responses with a per-route TTL, coalescing concurrent misses and answering If-None-Match with 304.
+
+        @self.app.get("/api/sample/")
+        @self.responseCache.cached(ttl=30)
+        async def get_api_sample(): ...
+
+    Services sharing a Redis need their own keyPrefix, the keys are only method, path and query.
+    Returned dicts are encoded with responseClass, by default the app's default_response_class,
+    so a cached route answers with the same body as an uncached one.
+    """
+
+    def __init__(self, redisUrl=None, sharedBackend=None, maxEntries=10000, maxBytes=64 * 1024 * 1024, keyPrefix="response-cache:", responseClass=None):
+        self.localBackend = MEMORY_CACHE_BACKEND(maxEntries, maxBytes)
+        if sharedBackend is None and redisUrl is not None:
+            sharedBackend = REDIS_CACHE_BACKEND(redisUrl, keyPrefix)
+        self.sharedBackend = sharedBackend
+        self.responseClass = responseClass
+        self.inFlight = {}  # key -> future of the entry being computed
+        self.hits = 0
+        self.misses = 0
+
+    def build_key(self, request, varyHeaders):
+        query = "&".join(sorted(f"{name}={value}" for name, value in request.query_params.multi_items()))
+        key = f"{request.method}:{request.url.path}?{query}"
+        for header in varyHeaders:
+            key += f"|{header}={request.headers.get(header, '')}"
+        return key
+
+    async def lookup(self, key):
+        entry = await self.localBackend.get(key)
+        if entry is None and self.sharedBackend is not None:
+            entry = await self.sharedBackend.get(key)
+            if entry is not None:
+                await self.localBackend.set(key, entry)
+        return entry
+
+    async def get_or_compute(self, key, ttl, compute):
+        entry = await self.lookup(key)
+        if entry is not None:
+            self.hits += 1
+            return entry
+
+        # Concurrent misses on the same key wait for the first one instead of recomputing
+        pending = self.inFlight.get(key)
+        if pending is not None:
+            self.hits += 1
+            return await asyncio.shield(pending)
+
+        self.misses += 1
+        future = asyncio.get_running_loop().create_future()
+        self.inFlight[key] = future
+        try:
+            result = await compute(ttl)
+            if not isinstance(result, CACHE_ENTRY):
+                # Not cacheable, waiters run the endpoint themselves
+                future.set_result(None)
+                return result
+            await self.localBackend.set(key, result)
+            if self.sharedBackend is not None:
+                await self.sharedBackend.set(key, result)
+            future.set_result(result)
+            return result
+        except BaseException as e:
+            future.set_exception(e)
+            # Nobody may be waiting, mark the exception as retrieved
+            future.exception()
+            raise
+        finally:
+            del self.inFlight[key]
+
+    async def invalidate(self, key):
+        await self.localBackend.delete(key)
+        if self.sharedBackend is not None:
+            await self.sharedBackend.delete(key)
+
+    def response_class(self, request):
+        if self.responseClass is not None:
+            return self.responseClass
+        defaultResponseClass = getattr(request.app.router, "default_response_class", JSONResponse)
+        # FastAPI wraps the class in a DefaultPlaceholder
+        return getattr(defaultResponseClass, "value", defaultResponseClass)
+
+    def cached(self, ttl=30, varyHeaders=()):
+        def decorator(endpoint):
+            signature = inspect.signature(endpoint)
+            parameters = list(signature.parameters.values())
+            requestParameter = next((parameter.name for parameter in parameters if parameter.annotation is Request), None)
+            if requestParameter is None:
+                # FastAPI passes the request to the wrapper only if the signature asks for it
+                requestParameter = "__cache_request"
+                parameters.append(inspect.Parameter(requestParameter, inspect.Parameter.KEYWORD_ONLY, annotation=Request))
+
+            async def compute(ttl, args, kwargs, request):
+                result = await endpoint(*args, **kwargs)
+                if isinstance(result, Response):
+                    if result.status_code != 200 or not hasattr(result, "body"):
+                        return result
+                    body, mediaType = result.body, result.media_type or "application/octet-stream"
+                else:
+                    # What FastAPI does with the result of an uncached route
+                    body, mediaType = self.response_class(request)(jsonable_encoder(result)).body, "application/json"
+                etag = '"' + hashlib.blake2b(body, digest_size=16).hexdigest() + '"'
+                return CACHE_ENTRY(body, mediaType, etag, time.monotonic() + ttl)
+
+            @functools.wraps(endpoint)
+            async def wrapper(*args, **kwargs):
+                request = kwargs[requestParameter]
+                if requestParameter == "__cache_request":
+                    del kwargs[requestParameter]
+
+                key = self.build_key(request, varyHeaders)
+                entry = await self.get_or_compute(key, ttl, lambda ttl: compute(ttl, args, kwargs, request))
+                if entry is None:
+                    return await endpoint(*args, **kwargs)
+                if not isinstance(entry, CACHE_ENTRY):
+                    return entry
+
+                maxAge = max(0, int(entry.expiresAt - time.monotonic()))
+                headers = {"ETag": entry.etag, "Cache-Control": f"max-age={maxAge}"}
+                ifNoneMatch = request.headers.get("if-none-match")
+                if ifNoneMatch and (ifNoneMatch.strip() == "*" or entry.etag in [tag.strip().removeprefix("W/") for tag in ifNoneMatch.split(",")]):
+                    return Response(status_code=304, headers=headers)
+                return Response(content=entry.body, media_type=entry.mediaType, headers=headers)
+
+            wrapper.__signature__ = signature.replace(parameters=parameters)
+            return wrapper
+        return decorator
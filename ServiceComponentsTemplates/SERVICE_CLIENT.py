@@ -0,0 +1,122 @@
+import asyncio
+import json
+import os
+import random
+
+import aiohttp
+
+
+class SERVICE_RESPONSE():
+    __slots__ = ("status", "headers", "body")
+
+    def __init__(self, status, headers, body):
+        self.status = status
+        self.headers = headers
+        self.body = body
+
+    def json(self):
+        return json.loads(self.body)
+
+
+class SERVICE_CLIENT():
+    """HTTP client for calling other services by the name add-service gave them in .env.
+
+    SAMPLE resolves to the SAMPLE_SERVICE entry, either "host:port" or "unix:/path/to.sock"
+    for a co-located service. Every target gets its own keep-alive connection pool and a
+    semaphore bounding the requests in flight to it, so calls reuse connections instead
+    of paying a handshake each time:
+
+        response = await self.serviceClient.get("SAMPLE", "/api/sample/")
+
+    With a tracer every call is a CLIENT span and carries the trace context in traceparent.
+    """
+
+    RETRY_STATUSES = (502, 503, 504)
+    IDEMPOTENT_METHODS = ("GET", "HEAD", "OPTIONS", "PUT", "DELETE")
+
+    def __init__(self, maxConnectionsPerService=100, maxConcurrentRequests=100, connectTimeout=2, requestTimeout=10, retries=2, retryBackoff=0.1, keepAliveTimeout=30, tracer=None):
+        self.maxConnectionsPerService = maxConnectionsPerService
+        self.maxConcurrentRequests = maxConcurrentRequests
+        self.timeout = aiohttp.ClientTimeout(total=requestTimeout, connect=connectTimeout)
+        self.retries = retries
+        self.retryBackoff = retryBackoff
+        self.keepAliveTimeout = keepAliveTimeout
+        self.tracer = tracer
+
+        self.sessions = {}  # service name -> aiohttp.ClientSession
+        self.semaphores = {}  # service name -> asyncio.Semaphore
+
+    def resolve(self, serviceName):
+        address = os.getenv(f"{serviceName.upper()}_SERVICE")
+        if not address:
+            raise KeyError(f"{serviceName.upper()}_SERVICE is not set in .env")
+        return address.strip().strip('"')
+
+    def get_session(self, serviceName):
+        session = self.sessions.get(serviceName)
+        if session is not None and not session.closed:
+            return session
+
+        address = self.resolve(serviceName)
+        if address.startswith("unix:"):
+            connector = aiohttp.UnixConnector(path=address[5:], limit=self.maxConnectionsPerService, keepalive_timeout=self.keepAliveTimeout)
+            baseUrl = "http://localhost"
+        else:
+            connector = aiohttp.TCPConnector(limit=self.maxConnectionsPerService, keepalive_timeout=self.keepAliveTimeout, ttl_dns_cache=300)
+            baseUrl = address if "://" in address else f"http://{address}"
+
+        session = self.sessions[serviceName] = aiohttp.ClientSession(base_url=baseUrl, connector=connector, timeout=self.timeout)
+        self.semaphores[serviceName] = asyncio.Semaphore(self.maxConcurrentRequests)
+        return session
+
+    async def request(self, serviceName, method, path, retries=None, **kwargs):
+        method = method.upper()
+        if self.tracer is None:
+            return await self.send(serviceName, method, path, retries, **kwargs)
+
+        with self.tracer.span(f"{method} {serviceName}", "CLIENT", attributes={"http.request.method": method, "server.address": serviceName, "url.path": path}) as span:
+            kwargs["headers"] = self.tracer.inject(dict(kwargs.get("headers") or {}), span)
+            response = await self.send(serviceName, method, path, retries, **kwargs)
+            span.set_attribute("http.response.status_code", response.status)
+            return response
+
+    async def send(self, serviceName, method, path, retries=None, **kwargs):
+        session = self.get_session(serviceName)
+        semaphore = self.semaphores[serviceName]
+        # Non-idempotent calls are only retried when explicitly asked for
+        if retries is None:
+            retries = self.retries if method in self.IDEMPOTENT_METHODS else 0
+
+        attempt = 0
+        while True:
+            try:
+                async with semaphore:
+                    async with session.request(method, path, **kwargs) as response:
+                        body = await response.read()
+                if response.status not in self.RETRY_STATUSES or attempt >= retries:
+                    return SERVICE_RESPONSE(response.status, response.headers, body)
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError):
+                if attempt >= retries:
+                    raise
+
+            # Full jitter keeps callers that failed together from retrying together
+            await asyncio.sleep(random.uniform(0, self.retryBackoff * 2 ** attempt))
+            attempt += 1
+
+    async def get(self, serviceName, path, **kwargs):
+        return await self.request(serviceName, "GET", path, **kwargs)
+
+    async def post(self, serviceName, path, **kwargs):
+        return await self.request(serviceName, "POST", path, **kwargs)
+
+    async def put(self, serviceName, path, **kwargs):
+        return await self.request(serviceName, "PUT", path, **kwargs)
+
+    async def delete(self, serviceName, path, **kwargs):
+        return await self.request(serviceName, "DELETE", path, **kwargs)
+
+    async def close(self):
+        for session in self.sessions.values():
+            await session.close()
+        self.sessions.clear()
+        self.semaphores.clear()
@@ -0,0 +1,324 @@
+import asyncio
+import collections
+import contextvars
+import json
+import os
+import random
+import re
+import sys
+import time
+
+import aiohttp
+
+currentSpan = contextvars.ContextVar("currentSpan", default=None)
+
+# version-traceId-parentId-flags, later versions may append fields
+TRACEPARENT = re.compile(r"([0-9a-f]{2})-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})(?:-|$)")
+INVALID_TRACE_ID = "0" * 32
+INVALID_SPAN_ID = "0" * 16
+
+
+class SPAN():
+    """One timed operation of a trace, ids are lowercase hex. Spans of unsampled traces only carry the ids to propagate."""
+
+    __slots__ = ("traceId", "spanId", "parentId", "sampled", "name", "kind", "start", "end", "attributes", "error")
+
+    def __init__(self, traceId, spanId, parentId, sampled, name=None, kind=None):
+        self.traceId = traceId
+        self.spanId = spanId
+        self.parentId = parentId
+        self.sampled = sampled
+        self.name = name
+        self.kind = kind
+        self.start = time.time_ns() if sampled else 0
+        self.end = 0
+        self.attributes = {} if sampled else None
+        self.error = None
+
+    def set_attribute(self, key, value):
+        if self.sampled:
+            self.attributes[key] = value
+
+    def traceparent(self):
+        return "00-" + self.traceId + "-" + self.spanId + ("-01" if self.sampled else "-00")
+
+
+class SPAN_SCOPE():
+    """Makes a span the current one for a with block and ends it afterwards."""
+
+    __slots__ = ("tracer", "span", "token")
+
+    def __init__(self, tracer, span):
+        self.tracer = tracer
+        self.span = span
+        self.token = None
+
+    def __enter__(self):
+        self.token = currentSpan.set(self.span)
+        return self.span
+
+    def __exit__(self, excType, exc, traceback):
+        currentSpan.reset(self.token)
+        if exc is not None and self.span.sampled:
+            self.span.error = repr(exc)
+        self.tracer.end_span(self.span)
+        return False
+
+
+class TRACER():
+    """Distributed tracing with W3C trace context over HTTP and RabbitMQ message headers.
+
+    The sampling decision is made once where a trace starts (sampleRate) and travels in the
+    traceparent header, so a trace is either recorded by every service or by none. Spans of
+    unsampled traces are never timed or recorded, only their ids are passed on. Finished
+    spans are appended to a bounded deque and a background task exports them in batches, as
+    JSON lines to exportPath and/or as OTLP/HTTP JSON to collectorUrl:
+
+        with self.tracer.span("load user") as span:
+            span.set_attribute("user.id", userId)
+            user = await self.mongoDb.find_one("users", {"_id": userId})
+
+    SERVICE_CLIENT, RABBITMQ_PUBLISHER and RABBITMQ_CONSUMER propagate the context when they
+    are given the tracer.
+    """
+
+    KINDS = {"INTERNAL": 1, "SERVER": 2, "CLIENT": 3, "PRODUCER": 4, "CONSUMER": 5}
+
+    def __init__(self, serviceName, sampleRate=0.01, exportPath=None, collectorUrl=None, maxQueuedSpans=10000, batchSize=512, flushInterval=1.0):
+        self.serviceName = serviceName
+        self.sampleRate = sampleRate
+        self.exportPath = exportPath
+        self.collectorUrl = collectorUrl
+        self.workerId = os.environ.get("HTTP_SERVER_WORKER_ID")
+
+        self.maxQueuedSpans = maxQueuedSpans
+        self.spans = collections.deque()
+        self.batchSize = batchSize
+        self.flushInterval = flushInterval
+
+        self.flushTask = None
+        self.flushLock = asyncio.Lock()
+        self.session = None
+        self.exportedSpans = 0
+        self.droppedSpans = 0
+        self.failedSpans = 0
+
+    def install(self, app):
+        app.add_middleware(TRACER_MIDDLEWARE, tracer=self)
+        app.router.on_shutdown.append(self.close)
+
+    def current(self):
+        return currentSpan.get()
+
+    def extract(self, headers):
+        """Return the remote parent from the traceparent of HTTP or message headers, None if it is missing or invalid."""
+        value = headers.get("traceparent") if headers else None
+        if value is None:
+            return None
+        if isinstance(value, bytes):
+            value = value.decode("latin-1")
+        value = value.strip()
+        match = TRACEPARENT.match(value)
+        if match is None:
+            return None
+        version, traceId, spanId, flags = match.groups()
+        if version == "ff" or traceId == INVALID_TRACE_ID or spanId == INVALID_SPAN_ID or (version == "00" and len(value) != 55):
+            return None
+        return SPAN(traceId, spanId, None, flags[1] in "13579bdf")
+
+    def inject(self, headers, span=None):
+        """Add the traceparent of span (the current span by default) to headers and return them."""
+        span = span or currentSpan.get()
+        if span is not None:
+            headers["traceparent"] = span.traceparent()
+        return headers
+
+    def start_span(self, name, kind="INTERNAL", parent=None):
+        """Start a child of parent, or a new trace with a fresh sampling decision when there is none."""
+        if parent is None:
+            return SPAN(random.randbytes(16).hex(), random.randbytes(8).hex(), None, random.random() < self.sampleRate, name, kind)
+        if not parent.sampled:
+            # Nothing is recorded, so the unsampled parent is passed on as it is
+            return parent
+        return SPAN(parent.traceId, random.randbytes(8).hex(), parent.spanId, True, name, kind)
+
+    def end_span(self, span):
+        if not span.sampled or span.end:
+            return
+        span.end = time.time_ns()
+        if len(self.spans) >= self.maxQueuedSpans:
+            self.droppedSpans += 1
+            return
+        self.spans.append(span)
+        if self.flushTask is None:
+            self.start_flusher()
+
+    def span(self, name, kind="INTERNAL", parent=None, attributes=None):
+        """Run a with block in a new span, a child of parent or of the current span."""
+        span = self.start_span(name, kind, parent or currentSpan.get())
+        if attributes and span.sampled:
+            span.attributes.update(attributes)
+        return SPAN_SCOPE(self, span)
+
+    def start_flusher(self):
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return  # Ended before the event loop runs, exported once a span ends on the loop
+        self.flushTask = loop.create_task(self.flush_periodically())
+
+    def to_dict(self, span):
+        return {
+            "traceId": span.traceId,
+            "spanId": span.spanId,
+            "parentSpanId": span.parentId,
+            "name": span.name,
+            "kind": span.kind,
+            "service": self.serviceName,
+            "workerId": self.workerId,
+            "startTimeUnixNano": span.start,
+            "endTimeUnixNano": span.end,
+            "durationMs": (span.end - span.start) / 1e6,
+            "attributes": span.attributes,
+            "error": span.error,
+        }
+
+    def to_otlp(self, batch):
+        """The batch as an OTLP/HTTP JSON ExportTraceServiceRequest."""
+        def attribute(key, value):
+            if isinstance(value, bool):
+                return {"key": key, "value": {"boolValue": value}}
+            if isinstance(value, int):
+                return {"key": key, "value": {"intValue": str(value)}}
+            if isinstance(value, float):
+                return {"key": key, "value": {"doubleValue": value}}
+            return {"key": key, "value": {"stringValue": str(value)}}
+
+        spans = []
+        for span in batch:
+            otlpSpan = {
+                "traceId": span.traceId,
+                "spanId": span.spanId,
+                "name": span.name,
+                "kind": self.KINDS.get(span.kind, 1),
+                "startTimeUnixNano": str(span.start),
+                "endTimeUnixNano": str(span.end),
+                "attributes": [attribute(key, value) for key, value in span.attributes.items()],
+                "status": {"code": 2, "message": span.error} if span.error else {},
+            }
+            if span.parentId:
+                otlpSpan["parentSpanId"] = span.parentId
+            spans.append(otlpSpan)
+        resource = {"attributes": [attribute("service.name", self.serviceName)]}
+        return {"resourceSpans": [{"resource": resource, "scopeSpans": [{"scope": {"name": "TRACER"}, "spans": spans}]}]}
+
+    def write_lines(self, lines):
+        # One O_APPEND write per batch, so the workers of a service can share the file
+        os.makedirs(os.path.dirname(self.exportPath) or ".", exist_ok=True)
+        fd = os.open(self.exportPath, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(fd, lines.encode())
+        finally:
+            os.close(fd)
+
+    async def export(self, batch):
+        if self.exportPath:
+            lines = "".join(json.dumps(self.to_dict(span), default=str) + "\n" for span in batch)
+            await asyncio.get_running_loop().run_in_executor(None, self.write_lines, lines)
+        if self.collectorUrl:
+            if self.session is None:
+                self.session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=10))
+            async with self.session.post(self.collectorUrl, json=self.to_otlp(batch)) as response:
+                if response.status >= 300:
+                    raise RuntimeError(f"collector answered {response.status}")
+
+    async def flush_periodically(self):
+        retryDelay = self.flushInterval
+        while True:
+            await asyncio.sleep(retryDelay)
+            try:
+                await self.flush()
+                retryDelay = self.flushInterval
+            except Exception as e:
+                # The queue stays bounded while the exporter is unavailable, new spans are dropped once it is full
+                retryDelay = min(retryDelay * 2, 30)
+                print(f"TRACER: could not export spans, retrying in {retryDelay:.1f}s: {e}", file=sys.stderr)
+
+    async def flush(self):
+        """Export every queued span, batchSize spans at a time."""
+        async with self.flushLock:
+            while self.spans:
+                batch = [self.spans.popleft() for _ in range(min(self.batchSize, len(self.spans)))]
+                try:
+                    await self.export(batch)
+                except Exception:
+                    self.failedSpans += len(batch)
+                    raise
+                self.exportedSpans += len(batch)
+
+    async def close(self):
+        if self.flushTask is not None:
+            async with self.flushLock:
+                self.flushTask.cancel()
+            await asyncio.gather(self.flushTask, return_exceptions=True)
+            self.flushTask = None
+        try:
+            await self.flush()
+        except Exception as e:
+            print(f"TRACER: {len(self.spans)} spans lost on shutdown: {e}", file=sys.stderr)
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+
+class TRACER_MIDDLEWARE():
+    def __init__(self, app, tracer):
+        self.app = app
+        self.tracer = tracer
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        tracer = self.tracer
+        parent = None
+        for name, value in scope["headers"]:
+            if name == b"traceparent":
+                parent = tracer.extract({"traceparent": value})
+                break
+        span = tracer.start_span(scope["method"], "SERVER", parent)
+        token = currentSpan.set(span)
+        if not span.sampled:
+            try:
+                await self.app(scope, receive, send)
+            finally:
+                currentSpan.reset(token)
+            return
+
+        status = 500
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        except BaseException as e:
+            span.error = repr(e)
+            raise
+        finally:
+            currentSpan.reset(token)
+            # The router stores the matched route in the scope, its template keeps span names bounded
+            route = scope.get("route")
+            routePath = getattr(route, "path", None)
+            span.name = f"{scope['method']} {routePath or scope['path']}"
+            span.attributes["http.request.method"] = scope["method"]
+            span.attributes["url.path"] = scope["path"]
+            if routePath:
+                span.attributes["http.route"] = routePath
+            span.attributes["http.response.status_code"] = status
+            if status >= 500 and span.error is None:
+                span.error = f"HTTP {status}"
+            tracer.end_span(span)
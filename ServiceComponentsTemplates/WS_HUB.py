@@ -0,0 +1,198 @@
+import asyncio
+import itertools
+import json
+import sys
+
+from fastapi import WebSocket
+
+
+class WS_CONNECTION():
+    """An accepted WebSocket with its bounded send queue and the rooms it joined."""
+
+    __slots__ = ("id", "websocket", "queue", "rooms", "writer", "closed")
+
+    def __init__(self, connectionId, websocket, maxQueuedMessages):
+        self.id = connectionId
+        self.websocket = websocket
+        self.queue = asyncio.Queue(maxQueuedMessages)
+        self.rooms = set()
+        self.writer = None
+        self.closed = False
+
+
+class WS_HUB():
+    """WebSocket endpoint with rooms and a broadcast that serializes each message once.
+
+    Messages are JSON text frames {"event": ..., "data": ...} in both directions. Incoming
+    events are dispatched to the handlers registered with @on, and a broadcast encodes its
+    message a single time and queues the same string for every member of the room:
+
+        @self.wsHub.on("join")
+        async def ws_join(connection, room):
+            self.wsHub.join(connection, room)
+
+        self.wsHub.broadcast("price", {"symbol": "ABC", "price": 12.5}, room="ABC")
+
+    Every connection has its own writer task draining a queue of at most maxQueuedMessages,
+    so one slow client never delays the others. A client whose queue is full is evicted and
+    closed with 1013 (try again later) instead of buffering without bound.
+    """
+
+    def __init__(self, maxQueuedMessages=256, closeTimeout=5):
+        self.maxQueuedMessages = maxQueuedMessages
+        self.closeTimeout = closeTimeout
+
+        self.connections = {}  # connection id -> WS_CONNECTION
+        self.rooms = {}  # room -> set of WS_CONNECTION, rooms without members are removed
+        self.handlers = {}  # event -> async handler(connection, data)
+        self.connectHandlers = []
+        self.disconnectHandlers = []
+        self.connectionIds = itertools.count(1)
+        self.closingTasks = set()  # Keeps the closes of evicted connections referenced until they finish
+
+        self.broadcasts = 0
+        self.evictedConnections = 0
+
+    def install(self, app, path="/ws/"):
+        app.add_api_websocket_route(path, self.serve)
+
+    def on(self, event):
+        def decorator(handler):
+            self.handlers[event] = handler
+            return handler
+        return decorator
+
+    def on_connect(self, handler):
+        self.connectHandlers.append(handler)
+        return handler
+
+    def on_disconnect(self, handler):
+        self.disconnectHandlers.append(handler)
+        return handler
+
+    async def serve(self, websocket: WebSocket):
+        await websocket.accept()
+        connection = WS_CONNECTION(next(self.connectionIds), websocket, self.maxQueuedMessages)
+        connection.writer = asyncio.get_running_loop().create_task(self.write(connection))
+        self.connections[connection.id] = connection
+        try:
+            for handler in self.connectHandlers:
+                await handler(connection)
+            while True:
+                message = await websocket.receive()
+                if message["type"] == "websocket.disconnect":
+                    break
+                text = message.get("text")
+                if text is None:
+                    text = message.get("bytes", b"").decode("utf-8", "replace")
+                await self.dispatch(connection, text)
+        finally:
+            connection.closed = True
+            self.remove(connection)
+            connection.writer.cancel()
+            for handler in self.disconnectHandlers:
+                await handler(connection)
+
+    async def dispatch(self, connection, text):
+        try:
+            message = json.loads(text)
+            handler = self.handlers.get(message["event"])
+        except (ValueError, TypeError, KeyError):
+            self.send(connection, "error", "Messages must be JSON objects with an event")
+            return
+        if handler is None:
+            self.send(connection, "error", f"Unknown event {message['event']}")
+            return
+        try:
+            await handler(connection, message.get("data"))
+        except Exception as e:
+            # A failing handler only answers the message that caused it, the connection stays open
+            print(f"WS_HUB: handler for {message['event']} failed: {e!r}", file=sys.stderr)
+            self.send(connection, "error", f"{message['event']} failed")
+
+    async def write(self, connection):
+        queue = connection.queue
+        sendText = connection.websocket.send_text
+        try:
+            while True:
+                await sendText(await queue.get())
+        except Exception:
+            # The client went away, the receive loop sees the disconnect and cleans up
+            pass
+
+    def encode(self, event, data):
+        return json.dumps({"event": event, "data": data}, separators=(",", ":"))
+
+    def join(self, connection, room):
+        if connection.closed:
+            return
+        self.rooms.setdefault(room, set()).add(connection)
+        connection.rooms.add(room)
+
+    def leave(self, connection, room):
+        members = self.rooms.get(room)
+        if members is not None:
+            members.discard(connection)
+            if not members:
+                del self.rooms[room]
+        connection.rooms.discard(room)
+
+    def remove(self, connection):
+        for room in list(connection.rooms):
+            self.leave(connection, room)
+        self.connections.pop(connection.id, None)
+
+    def send(self, connection, event, data):
+        """Queue a message for one connection, False if it is closed or was evicted."""
+        return self.enqueue(connection, self.encode(event, data))
+
+    def enqueue(self, connection, payload):
+        if connection.closed:
+            return False
+        try:
+            connection.queue.put_nowait(payload)
+        except asyncio.QueueFull:
+            self.evict(connection)
+            return False
+        return True
+
+    def broadcast(self, event, data, room=None, exclude=None):
+        """Queue a message for every member of room (every connection without one), returns how many got it."""
+        members = self.connections.values() if room is None else self.rooms.get(room, ())
+        if not members:
+            return 0
+        payload = self.encode(event, data)
+        self.broadcasts += 1
+
+        queued = 0
+        slowConnections = []
+        for connection in members:
+            if connection is exclude:
+                continue
+            try:
+                connection.queue.put_nowait(payload)
+                queued += 1
+            except asyncio.QueueFull:
+                slowConnections.append(connection)
+        # Evicting changes the member sets, so only after the loop
+        for connection in slowConnections:
+            self.evict(connection)
+        return queued
+
+    def evict(self, connection):
+        """Drop a connection that is not reading fast enough, its queued messages are discarded."""
+        if connection.closed:
+            return
+        connection.closed = True
+        self.evictedConnections += 1
+        self.remove(connection)
+        connection.writer.cancel()
+        task = asyncio.get_running_loop().create_task(self.close(connection, 1013, "Slow consumer"))
+        self.closingTasks.add(task)
+        task.add_done_callback(self.closingTasks.discard)
+
+    async def close(self, connection, code=1000, reason=""):
+        try:
+            await asyncio.wait_for(connection.websocket.close(code, reason), self.closeTimeout)
+        except Exception:
+            pass
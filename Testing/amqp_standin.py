@@ -0,0 +1,212 @@
+import asyncio
+import collections
+
+
+class StandinBroker():
+    """In-process stand-in for the parts of RabbitMQ/aio_pika our components use.
+
+    Every operation that needs a round trip to a real broker (connect, channel open,
+    exchange declare, publisher confirm) sleeps for roundTripSeconds, so benchmarks
+    measure how many round trips a publishing pattern costs without a running broker.
+    """
+
+    def __init__(self, roundTripSeconds=0.0005):
+        self.roundTripSeconds = roundTripSeconds
+        self.bindings = {}  # exchange name -> {routing key: [queues]}
+        self.queues = {}
+        self.roundTrips = 0
+
+    async def round_trip(self):
+        self.roundTrips += 1
+        await asyncio.sleep(self.roundTripSeconds)
+
+    async def connect_robust(self, url=None):
+        # TCP handshake, AMQP handshake and connection open
+        for _ in range(3):
+            await self.round_trip()
+        return StandinConnection(self)
+
+    def route(self, exchangeName, routingKey, message):
+        for queue in self.bindings.get(exchangeName, {}).get(routingKey, []):
+            queue.deliver(message)
+
+
+class StandinConnection():
+    def __init__(self, broker):
+        self.broker = broker
+        self.closed = False
+
+    async def channel(self, publisher_confirms=True):
+        await self.broker.round_trip()
+        return StandinChannel(self.broker, publisher_confirms)
+
+    async def close(self):
+        self.closed = True
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+
+class StandinChannel():
+    def __init__(self, broker, publisherConfirms):
+        self.broker = broker
+        self.publisherConfirms = publisherConfirms
+        self.prefetchCount = 0
+        # Delivery tags are per channel, so a multiple=True ack only covers this channel's deliveries
+        self.nextDeliveryTag = 1
+        self.unacked = {}  # delivery tag -> (queue, message, consumer tag)
+        self.settling = set()  # Acked or nacked, but the ack has not reached the broker yet
+
+    async def declare_exchange(self, name, type=None, **kwargs):
+        await self.broker.round_trip()
+        self.broker.bindings.setdefault(name, {})
+        return StandinExchange(self, name)
+
+    async def get_exchange(self, name, ensure=True):
+        if ensure:
+            await self.broker.round_trip()
+        return StandinExchange(self, name)
+
+    async def set_qos(self, prefetch_count=0, **kwargs):
+        await self.broker.round_trip()
+        self.prefetchCount = prefetch_count
+
+    async def declare_queue(self, name, **kwargs):
+        await self.broker.round_trip()
+        if name not in self.broker.queues:
+            self.broker.queues[name] = StandinQueue(self.broker, name)
+        return StandinQueueHandle(self.broker.queues[name], self)
+
+    def add_delivery(self, queue, message, consumerTag):
+        tag = self.nextDeliveryTag
+        self.nextDeliveryTag += 1
+        self.unacked[tag] = (queue, message, consumerTag)
+        return tag
+
+    def settle(self, deliveryTag, multiple, requeue=False):
+        tags = [tag for tag in self.unacked if tag <= deliveryTag and tag not in self.settling] if multiple else [deliveryTag]
+        for tag in tags:
+            if tag not in self.unacked or tag in self.settling:
+                raise RuntimeError(f"PRECONDITION_FAILED - unknown delivery tag {tag}")
+        self.settling.update(tags)
+        # The ack reaches the broker half a round trip later, only then is the prefetch window freed
+        asyncio.get_running_loop().call_later(self.broker.roundTripSeconds / 2, self.release, tags, requeue)
+
+    def release(self, tags, requeue):
+        queues = set()
+        for tag in tags:
+            self.settling.discard(tag)
+            queue, message, consumerTag = self.unacked.pop(tag)
+            queue.release(consumerTag, message, requeue)
+            queues.add(queue)
+        for queue in queues:
+            queue.dispatch()
+
+    async def close(self):
+        pass
+
+
+class StandinExchange():
+    def __init__(self, channel, name):
+        self.channel = channel
+        self.name = name
+
+    async def publish(self, message, routing_key, **kwargs):
+        self.channel.broker.route(self.name, routing_key, message)
+        if self.channel.publisherConfirms:
+            await self.channel.broker.round_trip()
+
+
+class StandinQueueHandle():
+    """A queue as seen from one channel, consuming through it uses that channel's prefetch."""
+
+    def __init__(self, queue, channel):
+        self.queue = queue
+        self.channel = channel
+        self.name = queue.name
+
+    async def bind(self, exchangeName, routing_key):
+        await self.queue.broker.round_trip()
+        queues = self.queue.broker.bindings.setdefault(exchangeName, {}).setdefault(routing_key, [])
+        if self.queue not in queues:
+            queues.append(self.queue)
+
+    async def consume(self, callback, no_ack=False, **kwargs):
+        await self.queue.broker.round_trip()
+        return self.queue.add_consumer(callback, self.channel)
+
+    async def cancel(self, consumerTag):
+        await self.queue.broker.round_trip()
+        self.queue.consumers.pop(consumerTag, None)
+
+
+class StandinQueue():
+    """Queue that enforces each consuming channel's prefetch and round-robins between consumers like the broker does.
+
+    Deliveries and acks each take half a round trip to arrive, so a small prefetch window
+    costs throughput the same way it does against a real broker.
+    """
+
+    def __init__(self, broker, name):
+        self.broker = broker
+        self.name = name
+        self.ready = collections.deque()
+        self.consumers = {}  # consumer tag -> [callback, channel, unacked count]
+        self.consumerCount = 0
+        self.nextConsumer = 0
+
+    def add_consumer(self, callback, channel):
+        self.consumerCount += 1
+        consumerTag = f"standin-consumer-{self.name}-{self.consumerCount}"
+        self.consumers[consumerTag] = [callback, channel, 0]
+        self.dispatch()
+        return consumerTag
+
+    def deliver(self, message):
+        self.ready.append(message)
+        self.dispatch()
+
+    def dispatch(self):
+        loop = asyncio.get_running_loop()
+        while self.ready and self.consumers:
+            consumerTags = list(self.consumers)
+            for offset in range(len(consumerTags)):
+                consumerTag = consumerTags[(self.nextConsumer + offset) % len(consumerTags)]
+                callback, channel, unacked = self.consumers[consumerTag]
+                if channel.prefetchCount == 0 or unacked < channel.prefetchCount:
+                    break
+            else:
+                return  # Every consumer has a full prefetch window
+            self.nextConsumer = (self.nextConsumer + offset + 1) % len(consumerTags)
+
+            message = self.ready.popleft()
+            self.consumers[consumerTag][2] += 1
+            incoming = StandinIncomingMessage(channel, channel.add_delivery(self, message, consumerTag), message)
+            loop.call_later(self.broker.roundTripSeconds / 2, self.run_consumer, callback, incoming)
+
+    def run_consumer(self, callback, incoming):
+        asyncio.get_running_loop().create_task(callback(incoming))
+
+    def release(self, consumerTag, message, requeue):
+        if consumerTag in self.consumers:
+            self.consumers[consumerTag][2] -= 1
+        if requeue:
+            self.ready.append(message)
+
+
+class StandinIncomingMessage():
+    def __init__(self, channel, deliveryTag, message):
+        self.channel = channel
+        self.delivery_tag = deliveryTag
+        self.body = message.body
+        self.headers = message.headers
+        self.message = message
+
+    async def ack(self, multiple=False):
+        self.channel.settle(self.delivery_tag, multiple)
+
+    async def nack(self, multiple=False, requeue=True):
+        self.channel.settle(self.delivery_tag, multiple, requeue)
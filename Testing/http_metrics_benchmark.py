@@ -0,0 +1,69 @@
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+from fastapi import FastAPI
+
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "ServiceComponentsTemplates"))
+from HTTP_METRICS import HTTP_METRICS
+
+
+def build_app(withMetrics):
+    app = FastAPI()
+
+    @app.get("/api/sample/")
+    async def get_api_sample():
+        return {"message": "Hello World"}
+
+    if withMetrics:
+        HTTP_METRICS().install(app)
+    return app
+
+
+async def call_app(app, path="/api/sample/"):
+    # Drive the ASGI app directly so the numbers are not drowned in socket and client overhead
+    scope = {"type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "GET", "scheme": "http", "path": path, "raw_path": path.encode(), "root_path": "", "query_string": b"", "headers": [(b"host", b"localhost")], "client": ("127.0.0.1", 50000), "server": ("127.0.0.1", 8080)}
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        pass
+
+    await app(scope, receive, send)
+
+
+async def measure(app, requests):
+    for _ in range(min(1000, requests)):
+        await call_app(app)
+    start = time.perf_counter()
+    for _ in range(requests):
+        await call_app(app)
+    return (time.perf_counter() - start) / requests
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Measure the per-request overhead of the HTTP_METRICS middleware")
+    parser.add_argument("--requests", type=int, default=20000)
+    parser.add_argument("--rounds", type=int, default=5)
+    args = parser.parse_args()
+
+    plainApp = build_app(False)
+    metricsApp = build_app(True)
+
+    plain = []
+    instrumented = []
+    for _ in range(args.rounds):
+        plain.append(await measure(plainApp, args.requests))
+        instrumented.append(await measure(metricsApp, args.requests))
+
+    plainBest = min(plain) * 1e6
+    instrumentedBest = min(instrumented) * 1e6
+    print(f"without metrics : {plainBest:8.2f} us/request")
+    print(f"with metrics    : {instrumentedBest:8.2f} us/request")
+    print(f"overhead        : {instrumentedBest - plainBest:8.2f} us/request ({(instrumentedBest / plainBest - 1) * 100:.1f}%)")
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,104 @@
+import argparse
+import asyncio
+import dataclasses
+import json
+import os
+import sys
+import time
+
+from fastapi import FastAPI
+
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "ServiceComponentsTemplates"))
+from HTTP_SERVER import JSON_RESPONSE
+
+ENCODERS = ("orjson", "msgspec", "stdlib")
+
+
+@dataclasses.dataclass
+class UserModel:
+    userId: int
+    name: str
+    email: str
+    active: bool
+    score: float
+    tags: list
+    createdAt: str
+
+
+def build_users(count):
+    return [UserModel(i, f"user{i}", f"user{i}@example.com", i % 3 != 0, i * 1.5, ["alpha", "beta"], "2024-01-01T00:00:00") for i in range(count)]
+
+
+def build_app(users, responseClass=None):
+    """The routes a service would have: a dict returned to FastAPI, a dict and typed models returned as JSON_RESPONSE."""
+    app = FastAPI(default_response_class=responseClass) if responseClass else FastAPI()
+    userDicts = [dataclasses.asdict(user) for user in users]
+
+    @app.get("/dict/")
+    async def get_dict():
+        return {"users": userDicts}
+
+    @app.get("/direct/")
+    async def get_direct():
+        return JSON_RESPONSE({"users": userDicts})
+
+    @app.get("/typed/")
+    async def get_typed():
+        return JSON_RESPONSE({"users": users})
+
+    return app
+
+
+async def call(app, path):
+    """One request straight through the ASGI app, so only the server-side cost is measured."""
+    scope = {"type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "GET", "scheme": "http", "path": path, "raw_path": path.encode(), "root_path": "", "query_string": b"", "headers": [], "client": ("127.0.0.1", 50000), "server": ("127.0.0.1", 80)}
+    body = []
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        if message["type"] == "http.response.body":
+            body.append(message.get("body", b""))
+
+    await app(scope, receive, send)
+    return b"".join(body)
+
+
+async def measure(app, path, requests):
+    body = await call(app, path)
+    start = time.perf_counter()
+    for _ in range(requests):
+        await call(app, path)
+    return (time.perf_counter() - start) / requests, body
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Compare the per-request cost of FastAPI's default JSON response with JSON_RESPONSE and typed models")
+    parser.add_argument("--items", default="1,100,1000,10000", help="Comma separated number of user records per response")
+    parser.add_argument("--requests", type=int, default=0, help="Requests per measurement (Default: about 0.5s worth)")
+    args = parser.parse_args()
+
+    encoders = [encoder for encoder in ENCODERS if JSON_RESPONSE.use(encoder) == encoder]
+    print(f"Available encoders: {', '.join(encoders)}")
+    print(f"{'ITEMS':>6} {'BYTES':>9} {'ROUTE':<32} {'US/REQ':>10} {'REQ/S':>9} {'SPEEDUP':>8}")
+
+    for count in [int(items) for items in args.items.split(",")]:
+        users = build_users(count)
+        requests = args.requests or max(20, 20000 // (count + 10))
+
+        baseline, baselineBody = await measure(build_app(users), "/dict/", requests)
+        expected = json.loads(baselineBody)
+        print(f"{count:>6} {len(baselineBody):>9} {'dict, FastAPI JSONResponse':<32} {baseline * 1e6:>10.1f} {1 / baseline:>9.0f} {1:>7.2f}x")
+
+        for encoder in encoders:
+            JSON_RESPONSE.use(encoder)
+            app = build_app(users, JSON_RESPONSE)
+            for path, label in (("/dict/", "dict"), ("/direct/", "JSON_RESPONSE(dict)"), ("/typed/", "JSON_RESPONSE(models)")):
+                elapsed, body = await measure(app, path, requests)
+                if json.loads(body) != expected:
+                    print(f"{encoder} {label} returned a different body")
+                print(f"{count:>6} {len(body):>9} {f'{label}, {encoder}':<32} {elapsed * 1e6:>10.1f} {1 / elapsed:>9.0f} {baseline / elapsed:>7.2f}x")
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,62 @@
+import dataclasses
+import json
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "ServiceComponentsTemplates"))
+from HTTP_SERVER import JSON_RESPONSE
+
+ENCODERS = ("orjson", "msgspec", "stdlib")
+
+
+@dataclasses.dataclass
+class MeasurementModel:
+    sensorId: int
+    value: float
+
+
+# (name, content, expected body): every encoder has to return the same body
+CASES = [
+    ("int over 64 bits", {"id": 2**70, "ids": [2**64, -2**63 - 1]}, {"id": 2**70, "ids": [2**64, -2**63 - 1]}),
+    ("int over 64 bits in a model", [MeasurementModel(2**65, 1.5)], [{"sensorId": 2**65, "value": 1.5}]),
+    ("NaN and Infinity", {"nan": float("nan"), "values": [1.0, float("inf"), float("-inf")], "pair": (float("nan"), 2)}, {"nan": None, "values": [1.0, None, None], "pair": [None, 2]}),
+    ("NaN in a model", [MeasurementModel(1, float("nan"))], [{"sensorId": 1, "value": None}]),
+    ("NaN next to an int over 64 bits", {"id": 2**70, "value": float("nan")}, {"id": 2**70, "value": None}),
+]
+
+
+def check_encoder(encoder):
+    failures = 0
+    for name, content, expected in CASES:
+        try:
+            body = JSON_RESPONSE(content).body
+            # parse_constant makes a NaN or Infinity that slipped through fail the comparison
+            problem = None if json.loads(body, parse_constant=str) == expected else f"returned {body.decode()}"
+        except Exception as e:
+            problem = f"raised {type(e).__name__}: {e}"
+        print(f"{'FAIL' if problem else 'ok':<5} {encoder:<8} {name}" + (f"\n      {problem}" if problem else ""))
+        failures += problem is not None
+
+    # Content no encoder can take still raises instead of returning something else
+    try:
+        JSON_RESPONSE({"value": object()})
+        print(f"FAIL  {encoder:<8} unsupported type\n      returned a body")
+        failures += 1
+    except TypeError:
+        print(f"ok    {encoder:<8} unsupported type")
+    return failures
+
+
+def main():
+    encoders = [encoder for encoder in ENCODERS if JSON_RESPONSE.use(encoder) == encoder]
+    print(f"Available encoders: {', '.join(encoders)}")
+    failures = 0
+    for encoder in encoders:
+        JSON_RESPONSE.use(encoder)
+        failures += check_encoder(encoder)
+    JSON_RESPONSE.use()
+    print(f"{failures} failures")
+    return failures == 0
+
+if __name__ == "__main__":
+    sys.exit(0 if main() else 1)
@@ -0,0 +1,69 @@
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "ServiceComponentsTemplates"))
+from MICRO_BATCHER import MICRO_BATCHER
+
+
+class SimulatedBackend():
+    """A backend with a fixed number of connections, a cost per call and a much smaller cost per item (like a DB query or model inference)."""
+
+    def __init__(self, connections, callCost, itemCost):
+        self.connections = asyncio.Semaphore(connections)
+        self.callCost = callCost
+        self.itemCost = itemCost
+        self.calls = 0
+
+    async def lookup_many(self, keys):
+        async with self.connections:
+            self.calls += 1
+            await asyncio.sleep(self.callCost + self.itemCost * len(keys))
+            return [{"key": key} for key in keys]
+
+
+async def run_requests(handler, requests, concurrency):
+    latencies = []
+    queue = iter(range(requests))
+
+    async def client():
+        for key in queue:
+            start = time.perf_counter()
+            await handler(key)
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*[client() for _ in range(concurrency)])
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    return requests / elapsed, latencies[len(latencies) // 2] * 1000, latencies[int(len(latencies) * 0.99)] * 1000
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Compare per-request backend calls with MICRO_BATCHER batches")
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--concurrency", type=int, default=200)
+    parser.add_argument("--connections", type=int, default=4)
+    parser.add_argument("--call-cost-ms", type=float, default=2.0)
+    parser.add_argument("--item-cost-ms", type=float, default=0.02)
+    parser.add_argument("--max-batch-size", type=int, default=64)
+    parser.add_argument("--max-wait-ms", type=float, default=2.0)
+    args = parser.parse_args()
+
+    print(f"{'MODE':<12} {'REQ/S':>9} {'P50 (ms)':>9} {'P99 (ms)':>9} {'BACKEND CALLS':>14}")
+
+    backend = SimulatedBackend(args.connections, args.call_cost_ms / 1000, args.item_cost_ms / 1000)
+    async def direct(key):
+        return (await backend.lookup_many([key]))[0]
+    rps, p50, p99 = await run_requests(direct, args.requests, args.concurrency)
+    print(f"{'direct':<12} {rps:>9.0f} {p50:>9.2f} {p99:>9.2f} {backend.calls:>14}")
+
+    backend = SimulatedBackend(args.connections, args.call_cost_ms / 1000, args.item_cost_ms / 1000)
+    batched = MICRO_BATCHER(backend.lookup_many, maxBatchSize=args.max_batch_size, maxWait=args.max_wait_ms / 1000)
+    rps, p50, p99 = await run_requests(batched, args.requests, args.concurrency)
+    print(f"{'batched':<12} {rps:>9.0f} {p50:>9.2f} {p99:>9.2f} {backend.calls:>14}")
+
+if __name__ == "__main__":
+    asyncio.run(main())
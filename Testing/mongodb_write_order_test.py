@@ -0,0 +1,148 @@
+import argparse
+import asyncio
+import os
+import sys
+
+import pymongo
+from pymongo.errors import BulkWriteError
+
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "ServiceComponentsTemplates"))
+from MONGODB_CLIENT import MONGODB_CLIENT
+
+
+class StandinCollection():
+    """In-process stand-in for a collection's bulk_write, keyed by _id, for the operations the scenarios use.
+
+    Like pymongo, an unordered bulk runs all its inserts, then its updates, then its deletes and
+    goes on after an error, while an ordered bulk runs in order and stops at its first error.
+    """
+
+    def __init__(self):
+        self.documents = {}
+
+    def bulk_write(self, operations, ordered=True):
+        indexed = list(enumerate(operations))
+        if not ordered:
+            kinds = (pymongo.InsertOne, pymongo.UpdateOne, pymongo.DeleteOne)
+            indexed.sort(key=lambda item: [isinstance(item[1], kind) for kind in kinds].index(True))
+        writeErrors = []
+        for index, operation in indexed:
+            if self.apply(operation):
+                continue
+            writeErrors.append({"index": index, "code": 11000, "errmsg": "E11000 duplicate key error"})
+            if ordered:
+                break
+        if writeErrors:
+            raise BulkWriteError({"writeErrors": writeErrors, "writeConcernErrors": []})
+
+    def apply(self, operation):
+        """Apply one operation, False on a duplicate key."""
+        if isinstance(operation, pymongo.InsertOne):
+            document = operation._doc
+            if document["_id"] in self.documents:
+                return False
+            self.documents[document["_id"]] = dict(document)
+        elif isinstance(operation, pymongo.UpdateOne):
+            documentId = operation._filter["_id"]
+            if documentId not in self.documents:
+                if not operation._upsert:
+                    return True
+                self.documents[documentId] = {"_id": documentId}
+            self.documents[documentId].update(operation._doc["$set"])
+        else:
+            self.documents.pop(operation._filter["_id"], None)
+        return True
+
+    def find_one(self, filter):
+        return self.documents.get(filter["_id"])
+
+    def insert_one(self, document):
+        self.documents[document["_id"]] = dict(document)
+
+
+class StandinDatabase(dict):
+    def __missing__(self, collectionName):
+        collection = self[collectionName] = StandinCollection()
+        return collection
+
+
+class StandinClient():
+    def __init__(self):
+        self.databases = {}
+
+    def __getitem__(self, databaseName):
+        return self.databases.setdefault(databaseName, StandinDatabase())
+
+    def drop_database(self, databaseName):
+        self.databases.pop(databaseName, None)
+
+    def close(self):
+        pass
+
+
+async def run_scenario(mongoDb, name, existing, writes, expected, expectedFailures):
+    """Buffer writes in one flush window and compare the documents with expected (None means absent)."""
+    collection = mongoDb.database[name]
+    for document in existing:
+        await mongoDb.run(collection.insert_one, document)
+
+    failedBefore = mongoDb.failedWrites
+    for method, *args in writes:
+        await getattr(mongoDb, method)(name, *args)
+    await mongoDb.flush()
+
+    problems = []
+    for documentId, expectedDocument in expected.items():
+        document = await mongoDb.find_one(name, {"_id": documentId})
+        if document != expectedDocument:
+            problems.append(f"_id {documentId} is {document}, expected {expectedDocument}")
+    failures = mongoDb.failedWrites - failedBefore
+    if failures != expectedFailures:
+        problems.append(f"{failures} failed writes, expected {expectedFailures}")
+    print(f"{'FAIL' if problems else 'ok':<5} {name}" + "".join(f"\n      {problem}" for problem in problems))
+    return not problems
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Check that MONGODB_CLIENT's write-behind keeps the order of the writes to each document")
+    parser.add_argument("--mongo-url", help="Run against this MongoDB (a scratch database is created and dropped) instead of the in-process stand-in")
+    args = parser.parse_args()
+
+    if args.mongo_url:
+        client = pymongo.MongoClient(args.mongo_url)
+    else:
+        client = StandinClient()
+    databaseName = "mongodb_write_order_test"
+    client.drop_database(databaseName)
+    # Flushed by the scenarios only
+    mongoDb = MONGODB_CLIENT(databaseName, client=client, maxPoolSize=4, flushSize=10000, flushInterval=3600)
+
+    scenarios = [
+        ("delete_then_insert", [{"_id": 1, "v": "old"}],
+            [("delete_later", {"_id": 1}), ("insert_later", {"_id": 1, "v": "new"})],
+            {1: {"_id": 1, "v": "new"}}, 0),
+        ("update_then_insert", [],
+            [("update_later", {"_id": 2}, {"$set": {"v": "updated"}}), ("insert_later", {"_id": 2, "v": "inserted"})],
+            {2: {"_id": 2, "v": "inserted"}}, 0),
+        ("insert_update_delete_insert", [],
+            [("insert_later", {"_id": 3, "v": "first"}), ("update_later", {"_id": 3}, {"$set": {"v": "updated"}}), ("delete_later", {"_id": 3}), ("insert_later", {"_id": 3, "v": "second"})],
+            {3: {"_id": 3, "v": "second"}}, 0),
+        ("insert_then_delete", [],
+            [("insert_later", {"_id": 4, "v": "short lived"}), ("delete_later", {"_id": 4})],
+            {4: None}, 0),
+        ("writes_after_a_failed_one", [{"_id": 5, "v": "existing"}],
+            [("insert_later", {"_id": 5, "v": "duplicate"}), ("update_later", {"_id": 5}, {"$set": {"v": "after the error"}}), ("insert_later", {"_id": 6, "v": "after the error"})],
+            {5: {"_id": 5, "v": "after the error"}, 6: {"_id": 6, "v": "after the error"}}, 1),
+    ]
+    passed = 0
+    for name, existing, writes, expected, expectedFailures in scenarios:
+        passed += await run_scenario(mongoDb, name, existing, writes, expected, expectedFailures)
+    print(f"{passed} of {len(scenarios)} scenarios passed")
+
+    await mongoDb.close()
+    if args.mongo_url:
+        pymongo.MongoClient(args.mongo_url).drop_database(databaseName)
+    return passed == len(scenarios)
+
+if __name__ == "__main__":
+    sys.exit(0 if asyncio.run(main()) else 1)
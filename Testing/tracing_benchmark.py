@@ -0,0 +1,120 @@
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+from fastapi import FastAPI
+
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "ServiceComponentsTemplates"))
+from TRACER import TRACER
+
+
+def build_app(tracer, withMiddleware=True):
+    app = FastAPI()
+
+    @app.get("/api/sample/")
+    async def get_api_sample():
+        return {"message": "Hello World"}
+
+    @app.get("/api/nested/")
+    async def get_api_nested():
+        # A route adding one span of its own and preparing the headers of an outgoing call
+        with tracer.span("work"):
+            tracer.inject({})
+        return {"message": "Hello World"}
+
+    if withMiddleware:
+        tracer.install(app)
+    return app
+
+
+async def call_app(app, path, headers):
+    # Drive the ASGI app directly so the numbers are not drowned in socket and client overhead
+    scope = {"type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "GET", "scheme": "http", "path": path, "raw_path": path.encode(), "root_path": "", "query_string": b"", "headers": headers, "client": ("127.0.0.1", 50000), "server": ("127.0.0.1", 8080)}
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        pass
+
+    await app(scope, receive, send)
+
+
+async def measure(app, path, headers, requests):
+    for _ in range(min(1000, requests)):
+        await call_app(app, path, headers)
+    start = time.perf_counter()
+    for _ in range(requests):
+        await call_app(app, path, headers)
+    return (time.perf_counter() - start) / requests
+
+
+def measure_primitives(requests):
+    """The tracer's own cost per call, without the ASGI stack whose noise is larger than it."""
+    results = []
+    for sampleRate in (0, 1):
+        # Large enough to hold every span, nothing is exported here
+        tracer = TRACER("Benchmark", sampleRate=sampleRate, maxQueuedSpans=requests)
+        start = time.perf_counter()
+        for _ in range(requests):
+            with tracer.span("work") as span:
+                tracer.inject({}, span)
+        results.append((f"span() + inject(), {'sampled' if sampleRate else 'unsampled'}", (time.perf_counter() - start) / requests * 1e6))
+    parent = {"traceparent": "00-0af7651916cd43dd8448eb211c80319c-b7ad6b7169203331-01"}
+    start = time.perf_counter()
+    for _ in range(requests):
+        tracer.extract(parent)
+    results.append(("extract() of a traceparent", (time.perf_counter() - start) / requests * 1e6))
+    return results
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Measure the per-request overhead of the TRACER middleware at different sample rates")
+    parser.add_argument("--requests", type=int, default=20000)
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument("--sample-rates", default="0,0.01,1", help="Comma separated sample rates to measure")
+    args = parser.parse_args()
+
+    for label, cost in measure_primitives(args.requests):
+        print(f"{label:<44} {cost:>8.2f} us")
+    print()
+
+    exportDir = tempfile.mkdtemp(prefix="tracing-benchmark-")
+    # Without the middleware the nested route runs its span outside of any trace, as an unsampled root
+    plainApp = build_app(TRACER("Untraced", sampleRate=0), withMiddleware=False)
+    plainHeaders = [(b"host", b"localhost")]
+    print(f"{'SETUP':<44} {'US/REQ':>8} {'BASELINE':>9} {'OVERHEAD':>9} {'EXPORTED':>9} {'DROPPED':>8}")
+
+    cases = []
+    for sampleRate in [float(rate) for rate in args.sample_rates.split(",")]:
+        cases.append((f"new traces, sample rate {sampleRate:g}", sampleRate, "/api/sample/", plainHeaders))
+        cases.append((f"new traces + 1 span, sample rate {sampleRate:g}", sampleRate, "/api/nested/", plainHeaders))
+    # Requests of traces started elsewhere follow the caller's decision, whatever the local rate is
+    for flags, label in (("00", "unsampled"), ("01", "sampled")):
+        headers = plainHeaders + [(b"traceparent", f"00-0af7651916cd43dd8448eb211c80319c-b7ad6b7169203331-{flags}".encode())]
+        cases.append((f"incoming {label} traceparent", 0.01, "/api/sample/", headers))
+
+    for label, sampleRate, path, headers in cases:
+        # The queue is sized for every span of the run, so dropped spans would mean the exporter cannot keep up
+        tracer = TRACER("Benchmark", sampleRate=sampleRate, exportPath=os.path.join(exportDir, "spans.jsonl"), maxQueuedSpans=args.requests * 4)
+        app = build_app(tracer)
+        plain = []
+        elapsed = []
+        # Alternating with the untraced app keeps both exposed to the same machine noise
+        for _ in range(args.rounds):
+            plain.append(await measure(plainApp, path, plainHeaders, args.requests))
+            elapsed.append(await measure(app, path, headers, args.requests))
+            # Let the background exporter catch up between rounds, as it would between bursts
+            await tracer.flush()
+        await tracer.close()
+        best = min(elapsed) * 1e6
+        baseline = min(plain) * 1e6
+        print(f"{label:<44} {best:>8.2f} {baseline:>9.2f} {best - baseline:>9.2f} {tracer.exportedSpans:>9} {tracer.droppedSpans:>8}")
+
+    print(f"Spans written to {exportDir}")
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,114 @@
+import argparse
+import asyncio
+import multiprocessing
+import os
+import socket
+import time
+
+import uvicorn
+from fastapi import FastAPI
+
+REQUEST = b"GET /api/sample/ HTTP/1.1\r\nHost: localhost\r\n\r\n"
+
+
+def run_server(host, port, unixSocketPath):
+    # One server process accepting on both listeners, like an HTTP_SERVER with httpServerUnixSocket set
+    app = FastAPI()
+
+    @app.get("/api/sample/")
+    async def get_api_sample():
+        return {"message": "Hello World"}
+
+    # IPPROTO_TCP so asyncio sets TCP_NODELAY on accepted connections, as HTTP_SERVER.bind_socket does
+    tcpSocket = socket.socket(socket.AF_INET, socket.SOCK_STREAM, socket.IPPROTO_TCP)
+    tcpSocket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    tcpSocket.bind((host, port))
+    unixSocket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    unixSocket.bind(unixSocketPath)
+    server = uvicorn.Server(uvicorn.Config(app, log_level="warning"))
+    asyncio.run(server.serve(sockets=[tcpSocket, unixSocket]))
+
+
+async def open_connection(transport, args):
+    if transport == "tcp":
+        return await asyncio.open_connection(args.host, args.port)
+    return await asyncio.open_unix_connection(args.unix_socket)
+
+
+async def read_response(reader):
+    headers = await reader.readuntil(b"\r\n\r\n")
+    length = 0
+    for line in headers.split(b"\r\n"):
+        if line.lower().startswith(b"content-length:"):
+            length = int(line.split(b":", 1)[1])
+    await reader.readexactly(length)
+
+
+async def run_connection(transport, args, requests, latencies, reconnect):
+    reader, writer = await open_connection(transport, args)
+    for _ in range(requests):
+        start = time.perf_counter()
+        if reconnect:
+            writer.close()
+            reader, writer = await open_connection(transport, args)
+        writer.write(REQUEST)
+        await read_response(reader)
+        latencies.append(time.perf_counter() - start)
+    writer.close()
+
+
+async def measure(transport, args, connections, reconnect):
+    latencies = []
+    requestsPerConnection = args.requests // connections
+    start = time.perf_counter()
+    await asyncio.gather(*[run_connection(transport, args, requestsPerConnection, latencies, reconnect) for _ in range(connections)])
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    return {
+        "rps": len(latencies) / elapsed,
+        "p50": latencies[len(latencies) // 2] * 1e6,
+        "p99": latencies[int(len(latencies) * 0.99)] * 1e6,
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Compare TCP loopback and Unix domain socket latency and throughput against one service")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=18400)
+    parser.add_argument("--unix-socket", default="/tmp/uds-benchmark.sock")
+    parser.add_argument("--requests", type=int, default=20000)
+    parser.add_argument("--connections", type=int, default=50)
+    args = parser.parse_args()
+
+    if os.path.exists(args.unix_socket):
+        os.unlink(args.unix_socket)
+    server = multiprocessing.Process(target=run_server, args=(args.host, args.port, args.unix_socket), daemon=True)
+    server.start()
+    try:
+        for _ in range(100):
+            try:
+                reader, writer = await open_connection("unix", args)
+                writer.close()
+                break
+            except OSError:
+                await asyncio.sleep(0.05)
+
+        scenarios = [
+            ("latency, 1 keep-alive connection", 1, False),
+            (f"throughput, {args.connections} keep-alive connections", args.connections, False),
+            (f"throughput, new connection per request x{args.connections}", args.connections, True),
+        ]
+        print(f"{'SCENARIO':<50} {'TRANSPORT':<9} {'REQ/S':>9} {'P50 (us)':>9} {'P99 (us)':>9}")
+        for description, connections, reconnect in scenarios:
+            for transport in ("tcp", "unix"):
+                await measure(transport, args, connections, reconnect)  # Warm up
+                result = await measure(transport, args, connections, reconnect)
+                print(f"{description:<50} {transport:<9} {result['rps']:>9.0f} {result['p50']:>9.0f} {result['p99']:>9.0f}")
+    finally:
+        server.terminate()
+        server.join()
+        if os.path.exists(args.unix_socket):
+            os.unlink(args.unix_socket)
+
+if __name__ == "__main__":
+    asyncio.run(main())
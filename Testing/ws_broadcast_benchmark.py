@@ -0,0 +1,296 @@
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "ServiceComponentsTemplates"))
+
+# once: WS_HUB.broadcast serializes each message once, per-connection: serialized again for every client
+MODES = ("once", "per-connection")
+
+
+def raise_open_file_limit():
+    # Every client connection is a file descriptor, on both sides
+    try:
+        import resource
+    except ImportError:
+        return
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft != hard:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+
+def serve(args):
+    """The server side, run in its own process so it does not share the CPU time of the clients' event loop."""
+    import uvicorn
+    from fastapi import FastAPI
+    from WS_HUB import WS_HUB
+
+    app = FastAPI()
+    hub = WS_HUB(maxQueuedMessages=args.max_queued)
+    hub.install(app, "/ws/")
+
+    @hub.on("join")
+    async def ws_join(connection, room):
+        hub.join(connection, room)
+
+    @hub.on("broadcast")
+    async def ws_broadcast(connection, data):
+        if data["perConnection"]:
+            for member in list(hub.rooms.get(data["room"], ())):
+                hub.send(member, "tick", data["message"])
+        else:
+            hub.broadcast("tick", data["message"], room=data["room"])
+
+    @hub.on("stats")
+    async def ws_stats(connection, data):
+        hub.send(connection, "stats", {"Connections": len(hub.connections), "EvictedConnections": hub.evictedConnections})
+
+    raise_open_file_limit()
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning", backlog=4096, timeout_graceful_shutdown=5)
+
+
+def client_frame(text):
+    """A masked text frame, clients must mask. The all-zero key leaves the payload as it is."""
+    payload = text.encode()
+    if len(payload) < 126:
+        header = bytes([0x81, 0x80 | len(payload)])
+    elif len(payload) < 65536:
+        header = bytes([0x81, 0x80 | 126]) + len(payload).to_bytes(2, "big")
+    else:
+        header = bytes([0x81, 0x80 | 127]) + len(payload).to_bytes(8, "big")
+    return header + b"\x00\x00\x00\x00" + payload
+
+
+class BenchmarkClient(asyncio.Protocol):
+    """A minimal WebSocket client that only timestamps the frames it receives, so the clients cost as little CPU as possible."""
+
+    def __init__(self, host, port, room, slow=False):
+        self.host = host
+        self.port = port
+        self.room = room
+        self.slow = slow
+        self.transport = None
+        self.buffer = bytearray()
+        self.upgraded = asyncio.get_running_loop().create_future()
+        self.arrivals = []
+        self.texts = []  # Only kept for the controller connection
+        self.keepTexts = False
+        self.closed = False
+
+    def connection_made(self, transport):
+        self.transport = transport
+        transport.write(f"GET /ws/ HTTP/1.1\r\nHost: {self.host}:{self.port}\r\nUpgrade: websocket\r\nConnection: Upgrade\r\nSec-WebSocket-Key: dGhlIHNhbXBsZSBub25jZQ==\r\nSec-WebSocket-Version: 13\r\n\r\n".encode())
+
+    def send(self, event, data):
+        self.transport.write(client_frame(json.dumps({"event": event, "data": data})))
+
+    def data_received(self, data):
+        self.buffer += data
+        if not self.upgraded.done():
+            headerEnd = self.buffer.find(b"\r\n\r\n")
+            if headerEnd == -1:
+                return
+            statusLine = bytes(self.buffer[:self.buffer.find(b"\r\n")])
+            del self.buffer[:headerEnd + 4]
+            if b" 101 " not in statusLine:
+                self.upgraded.set_exception(ConnectionError(statusLine.decode(errors="replace")))
+                return
+            if self.room is not None:
+                self.send("join", self.room)
+            if self.slow:
+                # Never read again, the server has to evict this client
+                self.transport.pause_reading()
+            self.upgraded.set_result(True)
+        self.parse_frames()
+
+    def parse_frames(self):
+        buffer = self.buffer
+        now = time.perf_counter()
+        while len(buffer) >= 2:
+            length = buffer[1] & 0x7F
+            offset = 2
+            if length == 126:
+                if len(buffer) < 4:
+                    return
+                length = int.from_bytes(buffer[2:4], "big")
+                offset = 4
+            elif length == 127:
+                if len(buffer) < 10:
+                    return
+                length = int.from_bytes(buffer[2:10], "big")
+                offset = 10
+            if len(buffer) < offset + length:
+                return
+            opcode = buffer[0] & 0x0F
+            if opcode == 0x1:
+                self.arrivals.append(now)
+                if self.keepTexts:
+                    self.texts.append(bytes(buffer[offset:offset + length]).decode())
+            elif opcode == 0x8:
+                self.closed = True
+                self.transport.close()
+            del buffer[:offset + length]
+
+    def connection_lost(self, exc):
+        self.closed = True
+        if not self.upgraded.done():
+            self.upgraded.set_exception(exc or ConnectionError("closed before the upgrade"))
+
+
+async def open_clients(args, count, rooms, slow=False):
+    loop = asyncio.get_running_loop()
+    semaphore = asyncio.Semaphore(args.connect_concurrency)
+
+    async def open_client(index):
+        async with semaphore:
+            _, client = await loop.create_connection(lambda: BenchmarkClient(args.host, args.port, f"room-{index % rooms}", slow), args.host, args.port)
+            await client.upgraded
+            return client
+
+    return await asyncio.gather(*[open_client(index) for index in range(count)])
+
+
+async def request_stats(controller):
+    controller.texts.clear()
+    controller.send("stats", None)
+    while not controller.texts:
+        await asyncio.sleep(0.01)
+    return json.loads(controller.texts[-1])["data"]
+
+
+def percentile(sortedLatencies, percent):
+    if not sortedLatencies:
+        return float("nan")
+    return sortedLatencies[min(len(sortedLatencies) - 1, int(len(sortedLatencies) * percent / 100))] * 1000
+
+
+async def run_mode(args, clients, controller, mode):
+    for client in clients:
+        client.arrivals.clear()
+    sentAt = {room: [] for room in range(args.rooms)}
+    message = {"payload": "x" * args.size}
+
+    start = time.perf_counter()
+    for sequence in range(args.broadcasts):
+        room = sequence % args.rooms
+        sentAt[room].append(time.perf_counter())
+        controller.send("broadcast", {"room": f"room-{room}", "perConnection": mode == "per-connection", "message": message})
+        await asyncio.sleep(args.interval_ms / 1000)
+
+    expected = {room: len(times) for room, times in sentAt.items()}
+    deadline = time.perf_counter() + args.timeout
+    while time.perf_counter() < deadline:
+        if all(client.closed or len(client.arrivals) >= expected[index % args.rooms] for index, client in enumerate(clients)):
+            break
+        await asyncio.sleep(0.05)
+    elapsed = time.perf_counter() - start
+
+    latencies = []
+    fanOutLatencies = {}  # (room, sequence) -> latency of the last client to get it
+    for index, client in enumerate(clients):
+        room = index % args.rooms
+        for sequence, arrival in enumerate(client.arrivals[:expected[room]]):
+            latency = arrival - sentAt[room][sequence]
+            latencies.append(latency)
+            fanOutLatencies[(room, sequence)] = max(latency, fanOutLatencies.get((room, sequence), 0))
+    latencies.sort()
+    fanOut = sorted(fanOutLatencies.values())
+    expectedDeliveries = sum(expected[index % args.rooms] for index in range(len(clients)))
+    return {
+        "Mode": mode,
+        "Deliveries": len(latencies),
+        "Lost": expectedDeliveries - len(latencies),
+        "DeliveryRate": len(latencies) / elapsed,
+        "P50Ms": percentile(latencies, 50),
+        "P99Ms": percentile(latencies, 99),
+        "FanOutP50Ms": percentile(fanOut, 50),
+        "FanOutP99Ms": percentile(fanOut, 99),
+    }
+
+
+async def wait_for_server(host, port, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            _, writer = await asyncio.open_connection(host, port)
+            writer.close()
+            return True
+        except OSError:
+            await asyncio.sleep(0.1)
+    return False
+
+
+async def main(args):
+    raise_open_file_limit()
+    server = None
+    if not args.external:
+        server = subprocess.Popen([sys.executable, os.path.abspath(__file__), "--serve", "--host", args.host, "--port", str(args.port), "--max-queued", str(args.max_queued)])
+    try:
+        if not await wait_for_server(args.host, args.port):
+            print(f"No server listening on {args.host}:{args.port}")
+            return
+
+        connectStart = time.perf_counter()
+        clients = await open_clients(args, args.connections, args.rooms)
+        slowClients = await open_clients(args, args.slow_clients, args.rooms, slow=True) if args.slow_clients else []
+        # The controller joins no room, it only asks for the broadcasts and the server stats
+        _, controller = await asyncio.get_running_loop().create_connection(lambda: BenchmarkClient(args.host, args.port, None), args.host, args.port)
+        await controller.upgraded
+        controller.keepTexts = True
+        print(f"Opened {len(clients)} connections (+{len(slowClients)} slow) in {time.perf_counter() - connectStart:.1f}s, {args.rooms} room(s), {args.broadcasts} broadcasts of {args.size} bytes every {args.interval_ms}ms")
+
+        print(f"{'MODE':<15} {'DELIVERIES/S':>13} {'P50 (ms)':>9} {'P99 (ms)':>9} {'FAN-OUT P50':>12} {'FAN-OUT P99':>12} {'LOST':>6} {'EVICTED':>8}")
+        results = []
+        for mode in args.modes.split(","):
+            if mode not in MODES:
+                print(f"Unknown mode {mode}, expected one of {', '.join(MODES)}")
+                continue
+            result = await run_mode(args, clients, controller, mode)
+            result.update(await request_stats(controller))
+            results.append(result)
+            print(f"{mode:<15} {result['DeliveryRate']:>13.0f} {result['P50Ms']:>9.2f} {result['P99Ms']:>9.2f} {result['FanOutP50Ms']:>12.2f} {result['FanOutP99Ms']:>12.2f} {result['Lost']:>6} {result['EvictedConnections']:>8}")
+
+        for client in [*clients, *slowClients, controller]:
+            client.transport.close()
+        # Let the loop actually close the sockets before the server is stopped
+        await asyncio.sleep(0.5)
+
+        if args.output:
+            with open(args.output, "w") as f:
+                json.dump({"Settings": vars(args), "Results": results}, f, indent=4)
+    finally:
+        if server is not None:
+            server.terminate()
+            try:
+                server.wait(10)
+            except subprocess.TimeoutExpired:
+                server.kill()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure WS_HUB broadcast delivery latency and throughput with many concurrent WebSocket clients")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=18765)
+    parser.add_argument("--external", action="store_true", help="Benchmark a server already started with --serve (e.g. on another machine) instead of starting one")
+    parser.add_argument("--serve", action="store_true", help="Only run the benchmark server")
+    parser.add_argument("--connections", type=int, default=10000)
+    parser.add_argument("--slow-clients", type=int, default=0, help="Extra clients that stop reading and should be evicted")
+    parser.add_argument("--rooms", type=int, default=1, help="Clients are spread over this many rooms, broadcasts go to one room at a time")
+    parser.add_argument("--broadcasts", type=int, default=50, help="Broadcasts per mode")
+    parser.add_argument("--interval-ms", type=float, default=200)
+    parser.add_argument("--size", type=int, default=256, help="Payload bytes per broadcast")
+    parser.add_argument("--max-queued", type=int, default=256, help="WS_HUB maxQueuedMessages of the server")
+    parser.add_argument("--modes", default=",".join(MODES), help=f"Comma separated, any of {', '.join(MODES)}")
+    parser.add_argument("--connect-concurrency", type=int, default=200)
+    parser.add_argument("--timeout", type=float, default=60, help="Seconds to wait for the deliveries after the last broadcast")
+    parser.add_argument("--output", help="Write the results as JSON to this file")
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args)
+    else:
+        asyncio.run(main(args))